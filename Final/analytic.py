@@ -0,0 +1,107 @@
+import numpy as np
+
+
+def effective_rate(mu, mtbf, mttr, mInt=np.inf, mTime=0.):
+    """
+    Returns the effective service rate of a unit with exponential service times at rate mu that is interrupted by
+    failures (exponential with mean mtbf, repair mean mttr) and maintenance (mean interval mInt, mean duration mTime).
+    As in the simulator, an interrupted job restarts its full service time after the repair, which gives a mean
+    completion time of (1 + mttr/mtbf + mTime/mInt) / (mu - 1/mtbf - 1/mInt). Returns 0 if jobs never complete.
+    """
+    f = 1. / mtbf + 1. / mInt
+    if f >= mu:
+        return 0.
+    return (mu - f) / (1. + mttr / mtbf + mTime / mInt)
+
+
+def variability(mu, mtbf, mttr, mInt=np.inf, mTime=0.):
+    """
+    Returns the squared coefficient of variation of the effective process time of a unit with exponential service times
+    at rate mu and exponential outages (failures and maintenance), following Hopp and Spearman (Factory Physics):
+    ce^2 = 1 + (1 + cr^2) A (1 - A) mr / t0 for every type of outage, with availability A and mean outage time mr.
+    """
+    ce2 = 1.
+    for between, duration in ((mtbf, mttr), (mInt, mTime)):
+        if np.isfinite(between) and duration > 0:
+            A = between / (between + duration)
+            ce2 += 2. * A * (1. - A) * duration * mu
+    return ce2
+
+
+def erlang_c(c, a):
+    """
+    Returns the probability that an arriving job has to wait in an M/M/c queue with offered load a = labda / mu.
+    """
+    rho = a / c
+    if rho >= 1:
+        return 1.
+    term = 1.
+    total = 1.
+    for k in range(1, c):
+        term *= a / k
+        total += term
+    term *= a / c
+    last = term / (1. - rho)
+    return last / (total + last)
+
+
+def tandem(labda, mu, mtbf, mttr, mInt=None, mTime=None, maxqueue=None, numServers=1, tolerance=1e-3):
+    """
+    Analytic estimate of a tandem line with Poisson arrivals at rate labda and exponential servers. Every server is
+    treated as an M/M/c station with the effective service rate of its units (see effective_rate), and the line as a
+    Jackson network, so the stations are independent and all see arrival rate labda. Without failures this is exact.
+    Failures make the effective process times more variable than exponential; this is taken into account with the
+    variability factor (ca^2 + ce^2) / 2 on the waiting time and the linking equation for the variability of the
+    departures, which both reduce to the Jackson network when ce^2 = 1.
+
+    Returns a dict with the cycle time, the throughput (items per second), the bottleneck server, a flag whether the
+    line is saturated (some station has utilization >= 1) and per station the effective rate, utilization, mean queue
+    length and cycle time. The flag valid is False when a finite maxqueue is reached with a probability above tolerance,
+    in which case blocking makes the estimate optimistic.
+    """
+    n = len(mu)
+    mInt = [np.inf] * n if mInt is None else mInt
+    mTime = [0.] * n if mTime is None else mTime
+    maxqueue = [np.inf] * n if maxqueue is None else maxqueue
+    numServers = [numServers] * n if np.isscalar(numServers) else numServers
+
+    stations = []
+    ca2 = 1.  # Poisson arrivals
+    for i in range(n):
+        c = numServers[i]
+        rate = effective_rate(mu[i], mtbf[i], mttr[i], mInt[i], mTime[i])
+        ce2 = variability(mu[i], mtbf[i], mttr[i], mInt[i], mTime[i])
+        rho = labda / (c * rate) if rate > 0 else np.inf
+        if rho < 1:
+            wait = (ca2 + ce2) / 2. * erlang_c(c, labda / rate) / (c * rate - labda)
+            ct = wait + 1. / rate
+            queue = labda * wait
+            # probability that the queue holds maxqueue or more jobs
+            full = erlang_c(c, labda / rate) * rho ** max(maxqueue[i], 0) if maxqueue[i] < np.inf else 0.
+        else:
+            ct, queue, full = np.inf, np.inf, 1.
+        stations.append({'rate': rate, 'capacity': c * rate, 'utilization': rho, 'queue': queue, 'cycletime': ct,
+                         'full': full, 'ca2': ca2, 'ce2': ce2})
+        u = min(rho, 1.)
+        ca2 = 1. + (1. - u ** 2) * (ca2 - 1.) + u ** 2 / np.sqrt(c) * (ce2 - 1.)
+
+    bottleneck = int(np.argmin([s['capacity'] for s in stations]))
+    saturated = any(s['utilization'] >= 1 for s in stations)
+    # the queue in front of the first server never blocks the sender
+    valid = all(s['full'] <= tolerance for s in stations[1:])
+    return {'cycletime': sum(s['cycletime'] for s in stations),
+            'throughput': min(labda, stations[bottleneck]['capacity']),
+            'bottleneck': bottleneck,
+            'saturated': saturated,
+            'valid': valid,
+            'stations': stations}
+
+
+def deviation(estimate, simulated):
+    """
+    Returns the relative deviation of a simulated cycle time (Sink.throughput()) from the analytic estimate, or inf when
+    the line is saturated and has no finite steady state cycle time.
+    """
+    if not np.isfinite(estimate['cycletime']):
+        return np.inf
+    return (simulated - estimate['cycletime']) / estimate['cycletime']
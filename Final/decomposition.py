@@ -0,0 +1,165 @@
+import numpy as np
+
+# states of the two machines of a two-machine line, (machine 1 up, machine 2 up)
+STATES = [(1, 1), (1, 0), (0, 1), (0, 0)]
+
+
+def two_machine_line(mu1, p1, r1, mu2, p2, r2, N):
+    """
+    Solves the continuous-flow two-machine line with a buffer of size N (np.inf for an unbounded buffer). Machine i
+    processes at rate mu_i while it is up, fails with rate p_i and is repaired with rate r_i. As in the simulator,
+    failures are time dependent: they also occur while a machine is starved or blocked. The first machine is never
+    starved and the second is never blocked.
+
+    The buffer level is a fluid queue modulated by the four machine states. Its distribution F(x) satisfies
+    F'(x) D = F(x) Q in the interior, which is solved with the eigenvectors of the generator Q (after eliminating the
+    states with zero drift) and the boundary conditions that states that fill (empty) the buffer have no probability
+    mass at an empty (full) buffer.
+
+    Returns a dict with the throughput, the mean buffer level and the starvation and blocking probabilities (buffer
+    empty and machine 1 down, buffer full and machine 2 down).
+    """
+    q1 = np.array([[-p1, p1], [r1, -r1]])
+    q2 = np.array([[-p2, p2], [r2, -r2]])
+    Q = np.kron(q1, np.eye(2)) + np.kron(np.eye(2), q2)
+    a1 = np.array([s[0] for s in STATES], dtype=float)
+    a2 = np.array([s[1] for s in STATES], dtype=float)
+    drift = mu1 * a1 - mu2 * a2
+    e1, e2 = r1 / (r1 + p1), r2 / (r2 + p2)
+    pi = np.array([e1 * e2, e1 * (1 - e2), (1 - e1) * e2, (1 - e1) * (1 - e2)])
+
+    # eliminate the states without drift: F_0 = -F_n Q_n0 Q_00^-1
+    zero = np.abs(drift) < 1e-12 * max(mu1, mu2)
+    n = ~zero
+    Q00inv = np.linalg.inv(Q[np.ix_(zero, zero)])
+    elim = -Q[np.ix_(n, zero)] @ Q00inv
+    Qr = Q[np.ix_(n, n)] + elim @ Q[np.ix_(zero, n)]
+    z, vectors = np.linalg.eig((Qr / drift[n]).T)
+    z, vectors = z.real, vectors.real.T  # rows are left eigenvectors
+
+    psi = np.zeros((len(z), len(STATES)))
+    psi[:, n] = vectors
+    psi[:, zero] = vectors @ elim
+
+    # scaled exponentials, bounded by one on [0, N]
+    def w(x):
+        return np.exp(np.where(z > 0, z * (x - N), z * x))
+
+    positive = np.where(drift > 0)[0]
+    negative = np.where(drift < 0)[0]
+    if np.isinf(N) and pi @ drift >= 0:
+        # the unbounded buffer grows without limit, so machine 2 is never starved
+        return {'throughput': mu2 * e2, 'level': np.inf, 'starved': 0., 'blocked': 0.}
+    if np.isinf(N):
+        # only the decaying exponentials are bounded and F(x) tends to pi, so no mass is left at a full buffer
+        decay = z < -1e-12 * np.abs(z).max()
+        z, psi = z[decay], psi[decay]
+        b = np.linalg.lstsq(psi[:, positive].T, -pi[positive], rcond=None)[0]
+        empty = np.clip(pi + b @ psi, 0., None)
+        full = np.zeros(len(STATES))
+        level = (b * psi.sum(axis=1) / z).sum()
+    else:
+        A = np.vstack([(w(0.) * psi[:, j]) for j in positive] + [(w(N) * psi[:, j]) for j in negative])
+        rhs = np.concatenate([np.zeros(len(positive)), pi[negative]])
+        b = np.linalg.lstsq(A, rhs, rcond=None)[0]
+        empty = np.clip((b * w(0.)) @ psi, 0., None)  # probability mass at an empty buffer
+        full = np.clip(pi - (b * w(N)) @ psi, 0., None)  # probability mass at a full buffer
+
+        # mean level: integral of P(X > x) over [0, N]
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            integral = np.where(np.abs(z) < 1e-12, N, np.where(z > 0, -np.expm1(-z * N), np.expm1(z * N)) / z)
+        level = N - (b * psi.sum(axis=1) * integral).sum()
+    throughput = mu2 * (a2 * (pi - empty)).sum() + (empty * np.minimum(mu2 * a2, mu1 * a1)).sum()
+    return {'throughput': throughput,
+            'level': min(max(level, 0.), N),
+            'starved': empty[a1 == 0].sum(),
+            'blocked': full[a2 == 0].sum()}
+
+
+def solve(mu, p, r, N, tolerance, maxiter):
+    # iterates the pseudo machines of the line until all two-machine lines have the same throughput
+    K = len(mu)
+    e = r / (r + p)
+    up = [[mu[i], p[i], r[i]] for i in range(K - 1)]  # upstream pseudo machines
+    down = [[mu[i + 1], p[i + 1], r[i + 1]] for i in range(K - 1)]  # downstream pseudo machines
+    lines = [two_machine_line(*(up[i] + down[i] + [N[i]])) for i in range(K - 1)]
+
+    iterations = 0
+    for iterations in range(1, maxiter + 1):
+        for i in range(1, K - 1):
+            prev = lines[i - 1]
+            starve = prev['starved'] * up[i - 1][2]
+            own = p[i] * e[i]
+            ru = (starve + own) / (starve / up[i - 1][2] + own / r[i])
+            ed = down[i - 1][2] / (down[i - 1][1] + down[i - 1][2])
+            inv = mu[i] / prev['throughput'] + 1. / e[i] - 1. / ed
+            up[i] = [mu[i], ru * max(inv - 1., 1e-12), ru]
+            lines[i] = two_machine_line(*(up[i] + down[i] + [N[i]]))
+        for i in range(K - 3, -1, -1):
+            nxt = lines[i + 1]
+            block = nxt['blocked'] * down[i + 1][2]
+            own = p[i + 1] * e[i + 1]
+            rd = (block + own) / (block / down[i + 1][2] + own / r[i + 1])
+            eu = up[i + 1][2] / (up[i + 1][1] + up[i + 1][2])
+            inv = mu[i + 1] / nxt['throughput'] + 1. / e[i + 1] - 1. / eu
+            down[i] = [mu[i + 1], rd * max(inv - 1., 1e-12), rd]
+            lines[i] = two_machine_line(*(up[i] + down[i] + [N[i]]))
+        tp = [line['throughput'] for line in lines]
+        if max(tp) - min(tp) <= tolerance * np.mean(tp):
+            break
+    return lines, iterations
+
+
+def decompose(mu, mtbf, mttr, maxqueue, labda=np.inf, mInt=None, mTime=None, tolerance=1e-6, maxiter=200):
+    """
+    Estimates the throughput and the mean queue lengths of a line of failure-prone servers with finite buffers, with the
+    decomposition method of Gershwin in the form of Dallery, David and Xie. The line is split into two-machine lines,
+    one per buffer, with an upstream pseudo machine that represents the line before the buffer and a downstream pseudo
+    machine that represents the line after it. The parameters of the pseudo machines are updated in forward and backward
+    passes until all two-machine lines have the same throughput:
+
+    - the down time of a pseudo machine mixes the repairs of its own machine and the starvation (blocking) of the next
+      pseudo machine up (down) the line, weighted by their frequencies,
+    - its availability follows from 1/(mu_i e_u(i)) + 1/(mu_i e_d(i-1)) = 1/E + 1/(mu_i e_i), with E the throughput.
+
+    The arguments are the per-server lists accepted by the Simulator, where maxqueue[i] is the buffer in front of server
+    i. Maintenance (mInt, mTime) is added as a second type of outage. The capacity of the line is found with a saturated
+    first server. When labda is below the capacity, the line is solved again with a reliable source machine of rate
+    labda in front of the first server. As in the simulator, the first queue is unbounded and never blocks the source,
+    so the throughput is labda and the queues follow from the arrival rate (iterations equal to maxiter means the queues
+    did not converge). The arrivals are treated as a fluid, so the queues only reflect the failures and the differences
+    in rate, not the randomness of the arrivals and service times; they are a screening estimate, below the queues of
+    the simulator.
+
+    Returns a dict with the throughput, the mean queue length in front of every server and the number of iterations
+    used. The flag saturated is True when the arrival rate exceeds the capacity of the line. The queue in front of the
+    first server then keeps growing and is nan, and the other queues are those of the saturated line.
+    """
+    K = len(mu)
+    mu = np.asarray(mu, dtype=float)
+    p = 1. / np.asarray(mtbf, dtype=float)
+    downtime = np.asarray(mttr, dtype=float) * p  # expected down time per unit of time
+    if mInt is not None:
+        pm = 1. / np.asarray(mInt, dtype=float)
+        downtime = downtime + np.asarray(mTime, dtype=float) * pm
+        p = p + pm
+    p = np.maximum(p, 1e-12)
+    r = p / np.maximum(downtime, 1e-12)
+    N = [float(q) for q in maxqueue]
+
+    if K == 1:
+        capacity, queues, iterations = mu[0] * r[0] / (r[0] + p[0]), [np.nan], 0
+    else:
+        lines, iterations = solve(mu, p, r, N[1:], tolerance, maxiter)
+        capacity = np.mean([line['throughput'] for line in lines])
+        queues = [np.nan] + [line['level'] for line in lines]
+    if labda >= capacity:
+        return {'throughput': capacity, 'queues': queues, 'iterations': iterations, 'saturated': True}
+
+    # a reliable source machine of rate labda feeds the first buffer, which never blocks the source
+    lines, iterations = solve(np.concatenate([[labda], mu]), np.concatenate([[1e-12], p]),
+                              np.concatenate([[1.], r]), [np.inf] + N[1:], tolerance, maxiter)
+    return {'throughput': labda,
+            'queues': [line['level'] for line in lines],
+            'iterations': iterations,
+            'saturated': False}
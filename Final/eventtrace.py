@@ -0,0 +1,89 @@
+import os
+import numpy as np
+
+# one fixed-width record per job event: arrival at a station, start of service and departure
+dtype = np.dtype([('time', 'f8'), ('job', 'i8'), ('station', 'i4'), ('event', 'u1'), ('queue', 'i4'),
+                  ('busy', 'i2')])
+codes = {'a': 0, 's': 1, 'd': 2}
+
+
+class TraceRecorder:
+    """
+    The trace recorder keeps the full per-job trace of the simulator in columnar form. Every record holds the time, the
+    job number, the station (server index), the event code (see codes), the queue length and the number of busy units
+    of the station. The records are written into a preallocated structured array of chunksize records, and a full chunk
+    is spilled to disk, so the memory use is bounded by one chunk.
+
+    While the simulation runs, the records are appended to path + '.part'. close writes them to path as a .npy file,
+    which is opened memory-mapped by records, so queries on long traces do not have to load the file. A checkpoint of a
+    traced simulation continues the same file, so only one of its forks should keep running with the recorder.
+    """
+    def __init__(self, path, chunksize=65536):
+        self.path = path
+        self.part = path + '.part'
+        self.chunk = np.zeros(chunksize, dtype=dtype)
+        self.fill = 0
+        self.n = 0
+        self.closed = False
+        self.file = open(self.part, 'wb')
+
+    def __getstate__(self):
+        self.flush()
+        state = self.__dict__.copy()
+        state['file'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if not self.closed:
+            self.file = open(self.part, 'r+b')
+            self.file.truncate(self.n * dtype.itemsize)
+            self.file.seek(0, os.SEEK_END)
+
+    def record(self, time, job, station, event, queue, busy):
+        self.chunk[self.fill] = (time, job, station, codes[event], queue, busy)
+        self.fill += 1
+        if self.fill == len(self.chunk):
+            self.flush()
+
+    def flush(self):
+        # spills the filled part of the chunk to disk
+        if self.fill and not self.closed:
+            self.chunk[:self.fill].tofile(self.file)
+            self.file.flush()
+            self.n += self.fill
+            self.fill = 0
+
+    def close(self):
+        # writes all records to a .npy file
+        if self.closed:
+            return
+        self.flush()
+        self.file.close()
+        out = np.lib.format.open_memmap(self.path, mode='w+', dtype=dtype, shape=(self.n,))
+        size = len(self.chunk)
+        for start in range(0, self.n, size):
+            out[start:start + size] = np.fromfile(self.part, dtype=dtype, count=min(size, self.n - start),
+                                                  offset=start * dtype.itemsize)
+        out.flush()
+        del out
+        os.remove(self.part)
+        self.closed = True
+
+    def records(self):
+        # memory-mapped view of all records so far
+        if self.closed:
+            return np.load(self.path, mmap_mode='r')
+        self.flush()
+        if self.n == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(self.part, dtype=dtype, mode='r', shape=(self.n,))
+
+    def select(self, event, station=None):
+        # records of one event type, optionally at one station
+        records = self.records()
+        mask = records['event'] == codes[event]
+        if station is not None:
+            mask &= records['station'] == station
+        return records[mask]
+
@@ -0,0 +1,231 @@
+from scipy.stats import expon
+import numpy as np
+import simulator as sim
+
+
+class FluidStation:
+    """
+    A station of the fluid model. It processes fluid at rate mu while it is up, and keeps the same failure, repair and
+    maintenance cycle as the units of the discrete simulator: failures and maintenance triggers are scheduled on
+    calendar time, a maintenance trigger during a failure aborts the repair, and a maintenance cancels the pending
+    failure.
+    """
+    def __init__(self, nr, mu, cap, mtbf, mttr, mInt, mTime, stoch):
+        self.name = 'Server {}'.format(nr + 1)
+        self.mu = mu
+        self.cap = cap  # capacity of the buffer in front of the station
+        self.mtbf, self.mttr, self.maintInt, self.maintTime = mtbf, mttr, mInt, mTime
+        self.stochastic = stoch
+        self.state = 'Up'
+        self.pending = {}  # event name -> time
+
+        # statistics
+        self.level = 0.
+        self.maxlevel = 0.
+        self.area = 0.
+        self.idletime = 0.
+        self.numfailures = 0
+        self.numMaint = 0
+        self.segments = []  # (start level, end level, duration) of the buffer level
+
+    def draw(self, value):
+        return value.rvs() if self.stochastic else value
+
+    def start(self, now):
+        self.pending['fail'] = now + self.draw(self.mtbf)
+        self.pending['trigger'] = now + self.draw(self.maintInt)
+
+    def next_event(self):
+        if not self.pending:
+            return np.inf, None
+        event = min(self.pending, key=self.pending.get)
+        return self.pending[event], event
+
+    def handle(self, event, now):
+        del self.pending[event]
+        if event == 'fail':
+            self.state = 'Failed'
+            self.numfailures += 1
+            self.pending['repair'] = now + self.draw(self.mttr)
+        elif event == 'repair':
+            self.state = 'Up'
+            self.pending['fail'] = now + self.draw(self.mtbf)
+        elif event == 'trigger':
+            self.pending.pop('fail', None)
+            self.pending.pop('repair', None)
+            self.state = 'Maintenance'
+            self.numMaint += 1
+            self.pending['maintcpl'] = now + self.draw(self.maintTime)
+        elif event == 'maintcpl':
+            self.state = 'Up'
+            self.start(now)
+
+
+class FluidSimulator:
+    """
+    The fluid simulator is a fast approximation of the discrete simulator for lines with high job rates. Jobs are
+    treated as a continuous flow: every station processes at rate mu while its buffer is non-empty, at the rate of its
+    inflow when its buffer is empty, and at the rate of the next station when the next buffer is full. Flow rates are
+    constant between events, so the simulator only steps at failures, repairs, maintenance, buffers becoming full or
+    empty, and the end of the arrivals. It takes the same inputs as the Simulator and uses the same random streams for
+    failures and maintenance, but it has no multi-unit or batch stations.
+
+    The outputs mirror Simulator.runDebug. Cycle times follow from the time-integrated buffer contents (Little's law)
+    plus the mean service times, and the queue length distributions are time averages instead of arrival averages.
+    """
+    eps = 1e-9
+
+    def __init__(self, totaljobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch, seed=1):
+        self.numSrv = len(mu)
+        self.totalJobs = totaljobs
+        self.labda = labda
+        self.seed = seed
+        seeds = np.random.SeedSequence(seed).spawn(self.numSrv + 1)
+        self.stations = []
+        for nr in range(self.numSrv):
+            rng = [np.random.default_rng(s) for s in seeds[nr + 1].spawn(5)]
+            cap = np.inf if nr == 0 else maxqueue[nr]  # the sender is never blocked
+            if stoch is True:
+                mtb = sim.VariateStream(expon(scale=mtbf[nr]), rng[1])
+                mtt = sim.VariateStream(expon(scale=mttr[nr]), rng[2])
+                mIn = sim.VariateStream(expon(scale=mInt[nr]), rng[3])
+                mTim = sim.VariateStream(expon(scale=mTime[nr]), rng[4])
+            else:
+                mtb, mtt, mIn, mTim = mtbf[nr], mttr[nr], mInt[nr], mTime[nr]
+            self.stations.append(FluidStation(nr, mu[nr], cap, mtb, mtt, mIn, mTim, stoch))
+        self.now = 0.
+        self.released = 0.
+        self.done = 0.
+        self.numEvents = 0
+        for station in self.stations:
+            station.start(self.now)
+
+    def rates(self, source):
+        # outflow rate of every station: starving is passed downstream, blocking upstream
+        r = np.zeros(self.numSrv)
+        for i, station in enumerate(self.stations):
+            if station.state == 'Up':
+                inflow = source if i == 0 else r[i - 1]
+                r[i] = station.mu if station.level > self.eps else min(station.mu, inflow)
+        for i in range(self.numSrv - 2, -1, -1):
+            if self.stations[i + 1].level >= self.stations[i + 1].cap - self.eps:
+                r[i] = min(r[i], r[i + 1])
+        return r
+
+    def step(self):
+        """
+        Advances the fluid model to the next event. Returns False when all jobs have left the line, or when nothing can
+        happen anymore.
+        """
+        if self.done >= self.totalJobs - self.eps:
+            return False
+        source = self.labda if self.released < self.totalJobs - self.eps else 0.
+        r = self.rates(source)
+        inflow = np.concatenate(([source], r[:-1]))
+        net = inflow - r
+
+        # time until the next event
+        tEvent, nrEvent, event = np.inf, None, None
+        for i, station in enumerate(self.stations):
+            t, name = station.next_event()
+            if t < tEvent:
+                tEvent, nrEvent, event = t, i, name
+        dt = tEvent - self.now
+        for station, n in zip(self.stations, net):
+            if n < 0 and station.level > self.eps:
+                dt = min(dt, station.level / -n)
+            elif n > 0 and station.cap < np.inf:
+                dt = min(dt, (station.cap - station.level) / n)
+        if source > 0:
+            dt = min(dt, (self.totalJobs - self.released) / source)
+        if r[-1] > 0:
+            dt = min(dt, (self.totalJobs - self.done) / r[-1])
+        if dt == np.inf:
+            return False
+        dt = max(dt, 0.)
+
+        # integrate buffer levels and idle time over the interval
+        for station, n, rate in zip(self.stations, net, r):
+            start = station.level
+            end = min(max(start + n * dt, 0.), station.cap)
+            if end < self.eps:
+                end = 0.
+            elif station.cap - end < self.eps:
+                end = station.cap
+            station.area += (start + end) / 2. * dt
+            station.maxlevel = max(station.maxlevel, end)
+            if station.state == 'Up':
+                station.idletime += (1. - rate / station.mu) * dt
+            if dt > 0:
+                station.segments.append((start, end, dt))
+            station.level = end
+        self.released = min(self.released + source * dt, self.totalJobs)
+        self.done = min(self.done + r[-1] * dt, self.totalJobs)
+        self.now += dt
+
+        if tEvent <= self.now + self.eps:
+            self.stations[nrEvent].handle(event, self.now)
+        self.numEvents += 1
+        return True
+
+    def run(self):
+        while self.step():
+            pass
+        return self.cycle_time()
+
+    # statistics
+    def cycle_time(self):
+        return sum(self.server_cycle_time(i) for i in range(self.numSrv))
+
+    def server_cycle_time(self, nr):
+        station = self.stations[nr]
+        return station.area / self.totalJobs + 1. / station.mu
+
+    def totaltime(self):
+        return self.now
+
+    def queue_distribution(self, nr):
+        # time fraction of every integer buffer level, from the piecewise linear level path
+        segments = np.array(self.stations[nr].segments)
+        if not len(segments):
+            return {}
+        lo = np.minimum(segments[:, 0], segments[:, 1])
+        hi = np.maximum(segments[:, 0], segments[:, 1])
+        d = segments[:, 2]
+        edges = np.arange(int(np.ceil(hi.max())) + 2)
+        width = np.where(hi > lo, hi - lo, 1.)
+        below = np.where((hi > lo)[:, None], np.clip((edges[None, :] - lo[:, None]) / width[:, None], 0., 1.),
+                         (lo[:, None] < edges[None, :]))
+        time = (d[:, None] * below).sum(axis=0)
+        dist = np.diff(time) / d.sum()
+        return {level: p for level, p in enumerate(dist) if p > 0}
+
+    def runDebug(self):
+        self.run()
+
+        print('Queue length distribution (time average):')
+        for srv in range(self.numSrv):
+            print('Server{}'.format(srv))
+            for i, v in self.queue_distribution(srv).items():
+                print(i, v)
+
+        for i, station in enumerate(self.stations):
+            print('Processed on server{}:'.format(i), int(self.totalJobs), 'Arrived:', int(self.totalJobs),
+                  'Failures: ', station.numfailures, 'Maintenance: ', station.numMaint)
+
+        print('Cycle time: {:.5} seconds'.format(self.cycle_time()))
+
+        for i, station in enumerate(self.stations):
+            print("Server {} has max queue length: {:.0f}".format(i, station.maxlevel))
+
+        for i in range(self.numSrv):
+            print("Server {} has CT: {:.5} seconds".format(i, self.server_cycle_time(i)))
+
+        print("Total time taken: {0:.2f} seconds".format(self.totaltime()))
+
+        total = self.totalJobs / self.totaltime()
+        print("Total throughput: {} items per second".format(total))
+
+        print('Idle percentage:')
+        for station in self.stations:
+            print('{0}: {1:.2f}'.format(station.name, station.idletime / self.totaltime() * 100), '%')
@@ -0,0 +1,115 @@
+import numpy as np
+import replication as rep
+
+
+def split(budget, n):
+    # divides the budget as equally as possible over n buffers
+    return [budget // n + (1 if i < budget % n else 0) for i in range(n)]
+
+
+class BufferOptimizer:
+    """
+    The buffer optimizer searches for the allocation of a total buffer budget over the queues of a line that maximizes
+    the throughput (items per second), using simulated annealing on top of the replication runner. In every iteration a
+    number of neighbours of the current allocation is made by moving buffer space from one queue to another, and all
+    neighbours are simulated in parallel. The best neighbour replaces the current allocation if it is better, or with
+    the Metropolis probability exp(delta / temperature) otherwise, where delta is the relative change in throughput.
+
+    All allocations are evaluated with common random numbers: replication r of every candidate uses the same seed, and
+    since every server has its own random streams, the candidates only differ in their buffers. With screenJobs set,
+    neighbours are first simulated with short runs, and neighbours that are more than margin worse than the current
+    allocation in the short runs are rejected without the full simulation.
+
+    The queue in front of the first server never blocks the sender, so by default the budget is divided over the other
+    queues (see buffers). The result contains the best allocation, as a maxqueue list for the Simulator, its throughput
+    and the cost curve: the current and best throughput after every iteration.
+    """
+    def __init__(self, base, budget, replications=5, seed=1, workers=None, buffers=None, neighbours=4, step=None,
+                 temperature=0.02, cooling=0.9, screenJobs=None, screenReplications=2, margin=0.05):
+        self.base = base
+        self.budget = int(budget)
+        self.buffers = list(range(1, len(base['mu']))) if buffers is None else list(buffers)
+        self.neighbours = neighbours
+        self.step = max(1, self.budget // (4 * len(self.buffers))) if step is None else step
+        self.temperature = temperature
+        self.cooling = cooling
+        self.screenJobs = screenJobs
+        self.margin = margin
+        self.runner = rep.ReplicationRunner(replications, seed=seed, workers=workers)
+        self.screener = rep.ReplicationRunner(screenReplications, seed=seed, workers=workers)
+        self.rng = np.random.default_rng(seed)
+        self.cache = {}  # allocation -> throughput of the full runs
+        self.screenCache = {}  # allocation -> throughput of the short runs
+        self.evaluations = 0
+        self.rejected = 0
+
+    def maxqueue(self, allocation):
+        maxqueue = list(self.base['maxqueue'])
+        for nr, size in zip(self.buffers, allocation):
+            maxqueue[nr] = size
+        return maxqueue
+
+    def evaluate(self, allocations, screen=False):
+        # returns the mean throughput of every allocation, only simulating allocations that are not cached yet
+        cache, runner = (self.screenCache, self.screener) if screen else (self.cache, self.runner)
+        totaljobs = self.screenJobs if screen else self.base['totaljobs']
+        todo = [a for a in dict.fromkeys(allocations) if a not in cache]
+        if todo:
+            scenarios = [dict(self.base, totaljobs=totaljobs, maxqueue=self.maxqueue(a)) for a in todo]
+            for allocation, results in zip(todo, runner.raw(scenarios)):
+                cache[allocation] = np.mean([totaljobs / r['totaltime'] for r in results])
+            if not screen:
+                self.evaluations += len(todo) * runner.replications
+        return [cache[a] for a in allocations]
+
+    def neighbour(self, allocation):
+        # moves buffer space from one queue to another, keeping at least one place in every queue
+        allocation = list(allocation)
+        donors = [i for i, size in enumerate(allocation) if size > 1]
+        if len(allocation) < 2 or not donors:
+            return tuple(allocation)
+        i = self.rng.choice(donors)
+        j = self.rng.choice([k for k in range(len(allocation)) if k != i])
+        amount = int(self.rng.integers(1, min(self.step, allocation[i] - 1) + 1))
+        allocation[i] -= amount
+        allocation[j] += amount
+        return tuple(allocation)
+
+    def screen(self, current, candidates):
+        # rejects candidates that are clearly worse than the current allocation in short runs
+        if self.screenJobs is None:
+            return candidates
+        values = self.evaluate([current] + candidates, screen=True)
+        survivors = [c for c, v in zip(candidates, values[1:]) if v >= (1. - self.margin) * values[0]]
+        self.rejected += len(candidates) - len(survivors)
+        return survivors
+
+    def run(self, iterations=20, start=None):
+        current = tuple(split(self.budget, len(self.buffers)) if start is None else start)
+        value = self.evaluate([current])[0]
+        best, bestValue = current, value
+        temperature = self.temperature
+        curve = [{'iteration': 0, 'evaluations': self.evaluations, 'current': value, 'best': bestValue,
+                  'temperature': temperature}]
+        for iteration in range(1, iterations + 1):
+            candidates = list(dict.fromkeys(self.neighbour(current) for _ in range(self.neighbours)))
+            candidates = self.screen(current, [c for c in candidates if c != current])
+            if candidates:
+                values = self.evaluate(candidates)
+                nr = int(np.argmax(values))
+                delta = (values[nr] - value) / value
+                if delta > 0 or self.rng.random() < np.exp(delta / temperature):
+                    current, value = candidates[nr], values[nr]
+                if value > bestValue:
+                    best, bestValue = current, value
+            temperature *= self.cooling
+            curve.append({'iteration': iteration, 'evaluations': self.evaluations, 'current': value,
+                          'best': bestValue, 'temperature': temperature})
+        return {'allocation': self.maxqueue(best), 'throughput': bestValue, 'curve': curve,
+                'evaluations': self.evaluations, 'rejected': self.rejected}
+
+    @staticmethod
+    def print_curve(curve):
+        print('{:>9} {:>11} {:>12} {:>12} {:>12}'.format('iteration', 'evaluations', 'current', 'best', 'temperature'))
+        for row in curve:
+            print('{iteration:>9} {evaluations:>11} {current:>12.5} {best:>12.5} {temperature:>12.5}'.format(**row))
@@ -0,0 +1,239 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+from scipy.stats import t as student
+import numpy as np
+import simulator as sim
+
+
+def outputs(experiment):
+    # output metrics of a finished experiment
+    total = experiment.sink.totaltime()
+    result = {'throughput': experiment.sink.throughput(), 'totaltime': total, 'rate': experiment.sink.numJobs / total}
+    for nr, server in enumerate(experiment.servers):
+        result['idle{}'.format(nr)] = server.idle_percentage(total)
+    return result
+
+
+def run_replication(task):
+    """
+    Runs a single replication of a scenario and returns its output metrics. The task is a tuple of the scenario (a dict
+    with the keyword arguments of the Simulator) and the seed of the replication. This function is used by the worker
+    processes of the replication runner, so it has to live at module level.
+    """
+    scenario, seed = task
+    experiment = sim.Simulator(seed=seed, **scenario)
+    experiment.run()
+    return outputs(experiment)
+
+
+def run_controlled(task):
+    """
+    Runs a single replication like run_replication, and returns its output metrics together with the control variates
+    of the run (see Simulator.controls).
+    """
+    scenario, seed = task
+    experiment = sim.Simulator(seed=seed, **scenario)
+    experiment.run()
+    return outputs(experiment), experiment.controls()
+
+
+def confidence_interval(values, confidence=0.95):
+    """
+    Returns the mean, the sample variance and the lower and upper bound of the Student-t confidence interval of values.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    mean = values.mean()
+    if n < 2:
+        return mean, np.nan, np.nan, np.nan
+    var = values.var(ddof=1)
+    half = student.ppf(0.5 + confidence / 2., n - 1) * np.sqrt(var / n)
+    return mean, var, mean - half, mean + half
+
+
+def welch_interval(a, b, confidence=0.95):
+    """
+    Returns the mean difference of two independent samples, the variance of that difference and the lower and upper
+    bound of its Welch confidence interval.
+    """
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    va, vb = a.var(ddof=1) / len(a), b.var(ddof=1) / len(b)
+    var = va + vb
+    df = var ** 2 / (va ** 2 / (len(a) - 1) + vb ** 2 / (len(b) - 1)) if var > 0 else 1
+    half = student.ppf(0.5 + confidence / 2., df) * np.sqrt(var)
+    diff = a.mean() - b.mean()
+    return diff, var * len(a), diff - half, diff + half
+
+
+def scenario_grid(base, **axes):
+    """
+    Builds a list of scenarios from a base scenario and one or more axes. Every axis maps a Simulator argument to a list
+    of values, and one scenario is made for every combination of values. For example, scenario_grid(base, mtbf=[...],
+    mttr=[...]) gives the MTBF x MTTR sweep.
+    """
+    names = list(axes)
+    scenarios = []
+    for values in product(*(axes[name] for name in names)):
+        scenario = dict(base)
+        scenario.update(zip(names, values))
+        scenarios.append(scenario)
+    return scenarios
+
+
+pools = {}  # process pools per number of workers
+
+
+def pool(workers):
+    """
+    Returns the process pool with the given number of workers. The pool is started on first use and kept for the
+    lifetime of the process, and it is shared by all runners, so callers that run a few replications at a time (like
+    the sequential selection and the buffer optimizer) do not pay for starting worker processes every round.
+    """
+    if workers not in pools:
+        pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return pools[workers]
+
+
+class ReplicationRunner:
+    """
+    The replication runner executes independent replications of one or more scenarios of the simulator. All
+    replications are distributed over a pool of worker processes. Replication r of every scenario uses the same seed,
+    while different replications use distinct seeds spawned from the seed of the runner. The result is a table with one
+    row per scenario and output metric, containing the mean, variance and confidence interval over the replications.
+    """
+    def __init__(self, replications, seed=1, workers=None, confidence=0.95):
+        self.replications = replications
+        self.seed = seed
+        self.workers = workers
+        self.confidence = confidence
+        self.seeds = [int(s) for s in np.random.SeedSequence(seed).generate_state(replications)]
+
+    def execute(self, tasks, function=run_replication):
+        if self.workers == 1:
+            return [function(task) for task in tasks]
+        return list(pool(self.workers).map(function, tasks))
+
+    def raw(self, scenarios):
+        # returns the output metrics per scenario, as a list of replication results
+        tasks = [(scenario, seed) for scenario in scenarios for seed in self.seeds]
+        results = self.execute(tasks)
+        n = self.replications
+        return [results[i * n:(i + 1) * n] for i in range(len(scenarios))]
+
+    def compare(self, a, b, paired=True, metrics=('throughput', 'rate')):
+        """
+        Compares scenario a with scenario b and returns one row per metric with the means of both scenarios and the
+        confidence interval of the difference a - b. Every station draws its service, failure, repair and maintenance
+        times from its own streams, so with paired=True (common random numbers) replication r of both scenarios sees
+        the same draws, job k gets the same service time draw in both, and the interval is computed on the paired
+        differences. The reduction is the variance of the difference under independent sampling divided by the paired
+        variance, which is about the factor by which pairing reduces the number of replications. With paired=False,
+        scenario b gets independent seeds and the Welch interval is used.
+        """
+        if paired:
+            resultsA, resultsB = self.raw([a, b])
+        else:
+            seeds = [int(s) for s in np.random.SeedSequence(self.seed).generate_state(2 * self.replications)]
+            n = self.replications
+            results = self.execute([(a, seed) for seed in seeds[:n]] + [(b, seed) for seed in seeds[n:]])
+            resultsA, resultsB = results[:n], results[n:]
+        table = []
+        for metric in metrics:
+            valuesA = np.array([r[metric] for r in resultsA])
+            valuesB = np.array([r[metric] for r in resultsB])
+            if paired:
+                diff, var, low, high = confidence_interval(valuesA - valuesB, self.confidence)
+            else:
+                diff, var, low, high = welch_interval(valuesA, valuesB, self.confidence)
+            independent = valuesA.var(ddof=1) + valuesB.var(ddof=1)
+            table.append({'metric': metric, 'n': self.replications, 'meanA': valuesA.mean(), 'meanB': valuesB.mean(),
+                          'diff': diff, 'var': var, 'low': low, 'high': high,
+                          'reduction': independent / var if var > 0 else np.inf})
+        return table
+
+    def antithetic(self, scenarios):
+        """
+        Runs every replication as an antithetic pair: one run draws all variates by inversion of uniforms U, the other
+        uses 1 - U with the same seed, and the pair average is one observation. The table holds one row per scenario and
+        metric like run, where n is the number of pairs. The reduction is the variance of the mean of 2n independent
+        runs divided by the variance of the mean of the n pairs; antithetic pairs pay off when it is larger than one.
+        """
+        if isinstance(scenarios, dict):
+            scenarios = [scenarios]
+        tasks = [(dict(scenario, antithetic=flag), seed) for scenario in scenarios for seed in self.seeds
+                 for flag in (False, True)]
+        results = self.execute(tasks)
+        n = self.replications
+        table = []
+        for nr in range(len(scenarios)):
+            runs = results[2 * n * nr:2 * n * (nr + 1)]
+            for metric in runs[0]:
+                values = np.array([r[metric] for r in runs])
+                mean, var, low, high = confidence_interval((values[0::2] + values[1::2]) / 2., self.confidence)
+                table.append({'scenario': nr, 'metric': metric, 'n': n, 'mean': mean, 'var': var, 'low': low,
+                              'high': high, 'reduction': values.var(ddof=1) / (2. * var) if var > 0 else np.inf})
+        return table
+
+    def control_variates(self, scenarios):
+        """
+        Estimates the output metrics with control variates: the deviations of the mean interarrival and service times of
+        every run from their known means 1/labda and 1/mu. The metric is regressed on the controls over the
+        replications, and the estimate is corrected by the fitted coefficients times the mean deviations. The
+        confidence interval uses the residual variance, with one degree of freedom less per control, so the number of
+        replications should be well above the number of servers. The reduction is the variance of the plain mean
+        divided by the variance of the controlled estimate.
+        """
+        if isinstance(scenarios, dict):
+            scenarios = [scenarios]
+        tasks = [(scenario, seed) for scenario in scenarios for seed in self.seeds]
+        results = self.execute(tasks, function=run_controlled)
+        n = self.replications
+        table = []
+        for nr in range(len(scenarios)):
+            runs = results[n * nr:n * (nr + 1)]
+            controls = np.array([c for r, c in runs])
+            centered = controls - controls.mean(axis=0)
+            q = controls.shape[1]
+            for metric in runs[0][0]:
+                values = np.array([r[metric] for r, c in runs])
+                beta = np.linalg.lstsq(centered, values - values.mean(), rcond=None)[0]
+                mean = values.mean() - controls.mean(axis=0) @ beta
+                residual = values - centered @ beta
+                df = n - 1 - q
+                if df < 1:
+                    raise ValueError('control variates need more than {} replications'.format(q + 1))
+                var = np.sum((residual - residual.mean()) ** 2) / df
+                half = student.ppf(0.5 + self.confidence / 2., df) * np.sqrt(var / n)
+                plain = values.var(ddof=1)
+                table.append({'scenario': nr, 'metric': metric, 'n': n, 'mean': mean, 'var': var, 'low': mean - half,
+                              'high': mean + half, 'reduction': plain / var if var > 0 else np.inf})
+        return table
+
+    def run(self, scenarios):
+        if isinstance(scenarios, dict):
+            scenarios = [scenarios]
+        table = []
+        for nr, results in enumerate(self.raw(scenarios)):
+            for metric in results[0]:
+                mean, var, low, high = confidence_interval([r[metric] for r in results], self.confidence)
+                table.append({'scenario': nr, 'metric': metric, 'n': len(results), 'mean': mean, 'var': var,
+                              'low': low, 'high': high})
+        return table
+
+    @staticmethod
+    def print_table(table):
+        reduction = bool(table) and 'reduction' in table[0]
+        print('{:>8} {:>10} {:>4} {:>12} {:>12} {:>12} {:>12}'.format('scenario', 'metric', 'n', 'mean', 'var', 'low',
+                                                                       'high') + (' {:>9}'.format('reduction')
+                                                                                  if reduction else ''))
+        for row in table:
+            print('{scenario:>8} {metric:>10} {n:>4} {mean:>12.5} {var:>12.5} {low:>12.5} {high:>12.5}'.format(**row) +
+                  (' {reduction:>9.3}'.format(**row) if reduction else ''))
+
+    @staticmethod
+    def print_comparison(table):
+        print('{:>10} {:>4} {:>12} {:>12} {:>12} {:>12} {:>12} {:>9}'.format('metric', 'n', 'mean A', 'mean B', 'diff',
+                                                                           'low', 'high', 'reduction'))
+        for row in table:
+            print('{metric:>10} {n:>4} {meanA:>12.5} {meanB:>12.5} {diff:>12.5} {low:>12.5} {high:>12.5} '
+                  '{reduction:>9.3}'.format(**row))
@@ -0,0 +1,90 @@
+import os
+import numpy as np
+import replication as rep
+
+
+class Selection:
+    """
+    Selects the best of a set of scenarios with the fully sequential procedure of Kim and Nelson (KN). Every scenario
+    first gets n0 replications. After that, every round adds step replications to the scenarios that are still in
+    contention (more when needed to give every worker a replication), and a scenario is eliminated as soon as its mean
+    is worse than the mean of another scenario by more than the continuation region allows. The selection stops when one
+    scenario is left, or when the continuation region has closed and the scenario with the best mean is taken. The
+    selected scenario is the best scenario with probability at least confidence, or within delta of the best (the
+    indifference zone). When maxReplications is reached first, the best mean is returned with identified set to False.
+
+    Replication r of every scenario uses the same seed, so the scenarios are compared with common random numbers, which
+    makes the variances of the differences, and hence the number of replications, smaller. The metric is one of the
+    outputs of run_replication; by default the cycle time (Sink.throughput), which is minimized.
+    """
+    def __init__(self, delta, confidence=0.95, n0=10, step=1, maxReplications=1000, metric='throughput',
+                 maximize=False, seed=1, workers=None):
+        self.delta = delta
+        self.confidence = confidence
+        self.n0 = n0
+        self.step = step
+        self.workers = workers or os.cpu_count() or 1
+        self.maxReplications = maxReplications
+        self.metric = metric
+        self.sign = 1. if maximize else -1.
+        self.runner = rep.ReplicationRunner(maxReplications, seed=seed, workers=workers)
+
+    def simulate(self, scenarios, contenders, start, stop):
+        # runs replications start..stop-1 of the contending scenarios and returns the metric (maximization sign)
+        tasks = [(scenarios[i], seed) for i in contenders for seed in self.runner.seeds[start:stop]]
+        results = self.runner.execute(tasks)
+        n = stop - start
+        return {i: self.sign * np.array([r[self.metric] for r in results[k * n:(k + 1) * n]])
+                for k, i in enumerate(contenders)}
+
+    def width(self, S2, h2, r):
+        # half width of the triangular continuation region after r replications
+        return max(0., self.delta / (2. * r) * (h2 * S2 / self.delta ** 2 - r))
+
+    def run(self, scenarios):
+        k = len(scenarios)
+        n0 = self.n0
+        alpha = 1. - self.confidence
+        eta = 0.5 * ((2. * alpha / max(k - 1, 1)) ** (-2. / (n0 - 1)) - 1.)
+        h2 = 2. * eta * (n0 - 1)
+
+        values = self.simulate(scenarios, range(k), 0, n0)
+        # variance of the pairwise differences from the first stage
+        S2 = {(i, l): np.var(values[i] - values[l], ddof=1) for i in range(k) for l in range(k) if i != l}
+        sums = {i: values[i].sum() for i in range(k)}
+        contenders = list(range(k))
+        eliminated = {}
+        r = n0
+        identified = k == 1
+        while not identified:
+            means = {i: sums[i] / r for i in contenders}
+            survivors = [i for i in contenders
+                         if all(means[i] >= means[l] - self.width(S2[i, l], h2, r) for l in contenders if l != i)]
+            for i in contenders:
+                if i not in survivors:
+                    eliminated[i] = r
+            contenders = survivors
+            # once the continuation region has closed, the scenario with the best mean is selected
+            identified = len(contenders) == 1 or all(self.width(S2[i, l], h2, r) == 0. for i in contenders
+                                                     for l in contenders if l != i)
+            if identified or r >= self.maxReplications:
+                break
+            # hand out at least one replication per worker, so the pool stays busy
+            step = max(self.step, -(-self.workers // len(contenders)))
+            stop = min(r + step, self.maxReplications)
+            for i, v in self.simulate(scenarios, contenders, r, stop).items():
+                sums[i] += v.sum()
+            r = stop
+
+        replications = [eliminated.get(i, r) for i in range(k)]
+        means = [self.sign * sums[i] / replications[i] for i in range(k)]
+        best = max(contenders, key=lambda i: self.sign * means[i])
+        return {'best': best, 'scenario': scenarios[best], 'means': means, 'replications': replications,
+                'total': sum(replications), 'identified': identified}
+
+    @staticmethod
+    def print_summary(result):
+        print('{:>8} {:>12} {:>12}'.format('scenario', 'mean', 'replications'))
+        for nr, (mean, n) in enumerate(zip(result['means'], result['replications'])):
+            print('{:>8} {:>12.5} {:>12}{}'.format(nr, mean, n, ' *' if nr == result['best'] else ''))
+        print('Total replications: {}'.format(result['total']))
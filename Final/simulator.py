@@ -1,9 +1,21 @@
-from collections import defaultdict
+from array import array
+from bisect import bisect_right, insort
+from collections import defaultdict, deque
+from heapq import heappop, heappush
+from itertools import count
+import gzip
+import pickle
 from sortedcontainers import SortedSet
-from scipy.stats import expon
-from transitions import Machine
+from scipy.stats import expon, t as student
+try:
+    from transitions import Machine
+except ImportError:  # transitions is only needed to validate the state machine
+    Machine = None
 # import matplotlib.pylab as plt
 import numpy as np
+import analytic
+import decomposition
+import eventtrace
 
 
 class Event:
@@ -12,7 +24,7 @@ class Event:
     jobs, the start of processing of jobs, maintenance tasks and more. All events are stored in the "Scheduler" and
     executed at the right time.
     """
-    __slots__ = ['f', 't', 'time', 'job', 'event']
+    __slots__ = ['f', 't', 'time', 'job', 'event', 'pending']
     
     def __init__(self, f, t, time, job=None, event=""):
         self.f = f  # from node
@@ -20,56 +32,164 @@ class Event:
         self.time = time  # time to deliver the message
         self.job = job 
         self.event = event
+        self.pending = False  # True while the event waits in the scheduler
 
     def __repr__(self):
         return "{} {} {} {}".format(self.f, self.t, self.time, self.event)
 
 
-class Scheduler(SortedSet):
+def event_time(m):
+    return m.time
+
+
+def arrival_time(job):
+    return job.arrivalTime
+
+
+class Sequenced:
+    """
+    Base class for containers that number their entries with a counter, to keep the order of entries with equal keys.
+    The counter is pickled as its next value.
+    """
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_seq'] = next(self._seq)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._seq = count(state['_seq'])
+
+
+class HeapCalendar(Sequenced):
+    """
+    Event calendar backed by a binary heap. Events are stored as (time, sequence, event) tuples, so events with equal
+    times are executed in the order in which they were added. This is the default calendar of the scheduler.
+    """
+    def __init__(self):
+        self._heap = []
+        self._seq = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        return (entry[2] for entry in sorted(self._heap))
+
+    def add(self, m):
+        heappush(self._heap, (m.time, next(self._seq), m))
+
+    def pop(self):
+        return heappop(self._heap)[2]
+
+    def peek(self):
+        return self._heap[0][2]
+
+    def clear(self):
+        del self._heap[:]
+
+
+class SortedCalendar(SortedSet):
+    """
+    Event calendar backed by a SortedSet keyed on the event time. This was the original calendar of the scheduler and is
+    kept for comparison with the heap calendar.
+    """
+    def __init__(self, iterable=None, key=event_time):
+        super().__init__(iterable, key=key)
+
+    def pop(self):
+        return super().pop(0)
+
+    def peek(self):
+        return self[0]
+
+
+calendars = {'heap': HeapCalendar, 'sorted': SortedCalendar}
+
+
+class Scheduler:
     """
     The scheduler handles all events in the simulator. Events are stored in a chronological way, and executed one by one
     The scheduler also contains the simulator clock, and can therefore be seen as the core of the event based simulator.
+    The events are kept in an event calendar, which is selected by name (see calendars).
+
+    Adding an event returns the event itself, which serves as a handle to cancel it. Cancelled events stay in the
+    calendar as tombstones and are skipped when they are popped, so cancelling takes constant time.
     """
-    def __init__(self):
-        super().__init__(key=lambda m: m.time)
+    def __init__(self, calendar='heap'):
+        self.calendar = calendars[calendar]()
         self.endOfSimultationTime = np.inf
         self._now = 0.
         self.completed = False
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self.calendar) - self._cancelled
+
+    def __iter__(self):
+        return (m for m in self.calendar if m.pending)
 
     def now(self):
         return self._now
 
     def add(self, m):
         if self._now < self.endOfSimultationTime:
-            super().add(m)
-        
-    def pop(self, index=0):
-        m = super().pop(0)
+            m.pending = True
+            self.calendar.add(m)
+            return m
+
+    def cancel(self, m):
+        if m is not None and m.pending:
+            m.pending = False
+            self._cancelled += 1
+
+    def pop(self):
+        m = self.calendar.pop()
+        while not m.pending:
+            self._cancelled -= 1
+            m = self.calendar.pop()
+        m.pending = False
         self._now = m.time
         m.t.receive(m)
         return m
 
-    def run(self):
+    def peek(self):
+        m = self.calendar.peek()
+        while not m.pending:
+            self.calendar.pop()
+            self._cancelled -= 1
+            m = self.calendar.peek()
+        return m
+
+    def step(self):
+        if len(self):
+            return self.pop()
+        return None
+
+    def clear(self):
+        for m in self.calendar:
+            m.pending = False
+        self.calendar.clear()
+        self._cancelled = 0
+
+    def run(self, until=None, max_events=None):
+        """
+        Executes events until the calendar is empty. When until is given, the run stops before the first event later
+        than that time and the clock is set to until; an until before the current time leaves the clock unchanged. If
+        the calendar empties first (for example because the sink has received all jobs), the clock stays at the time of
+        the last event. When max_events is given, at most that many events are executed. A stopped run can be resumed by
+        calling run again. Returns the number of executed events.
+        """
+        executed = 0
         while len(self):
-            self.pop()
-            if self._now > np.inf:
+            if max_events is not None and executed >= max_events:
                 break
-
-    def delete_job(self, server, job):
-        for index, value in enumerate(self):
-            if value.job == job and value.t == server:
-                # var = self[index]
-                del self[index]
-                # print('deleted', var.time, self.now())
-                # break
-
-    def delete_event(self, server, event):
-        for index, value in enumerate(self):
-            if value.event == event and value.t == server:
-                # var = self[index]
-                del self[index]
-                # print('deleted', var)
+            if until is not None and self.peek().time > until:
+                self._now = max(self._now, until)
                 break
+            self.pop()
+            executed += 1
+        return executed
 
     def print_self(self):
         print(self._now)
@@ -86,9 +206,376 @@ class Scheduler(SortedSet):
             node.scheduler = self
 
 
+class VariateStream:
+    """
+    The variate stream hands out random variates of a frozen scipy distribution one at a time. Instead of calling rvs()
+    for every variate, it draws blocks of variates from a numpy Generator and refills lazily when a block is used up.
+    The block size starts small and doubles up to blocksize, so rarely used streams (like maintenance) stay cheap.
+
+    The state of the generator is kept before every block is drawn. A pickled stream stores that state instead of the
+    block, and draws the block again when it is unpickled, which keeps checkpoints small.
+
+    With antithetic set to False or True, the variates are drawn by inversion of uniforms U, or of 1 - U for the
+    antithetic counterpart of a stream with the same generator. The mean of the variates handed out so far (drawn_mean)
+    serves as a control variate, as the true mean of the distribution is known.
+    """
+    def __init__(self, distrib, rng, blocksize=65536, antithetic=None):
+        self.distrib = distrib
+        self.rng = rng
+        self.blocksize = blocksize
+        self.antithetic = antithetic
+        self._size = min(64, blocksize)
+        self._block = []
+        self._index = 0
+        self._state = None
+        self._drawn = 0
+        self._total = 0.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_block'] = len(self._block)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        n, index, size = self._block, self._index, self._size
+        self._block = []
+        self._index = 0
+        if n:
+            self.rng.bit_generator.state = self._state
+            self._size = n
+            self.refill()
+            self._index = index
+            self._size = size
+
+    def rvs(self):
+        if self._index == len(self._block):
+            self.refill()
+        value = self._block[self._index]
+        self._index += 1
+        return value
+
+    def refill(self):
+        self._drawn += self._index
+        self._total += sum(self._block[:self._index])
+        self._state = self.rng.bit_generator.state
+        if self.antithetic is None:
+            self._block = self.distrib.rvs(size=self._size, random_state=self.rng).tolist()
+        else:
+            u = self.rng.random(self._size)
+            self._block = self.distrib.ppf(1. - u if self.antithetic else u).tolist()
+        self._index = 0
+        self._size = min(2 * self._size, self.blocksize)
+
+    def mean(self):
+        return self.distrib.mean()
+
+    def drawn_mean(self):
+        # mean of the variates handed out so far
+        n = self._drawn + self._index
+        if n == 0:
+            return np.nan
+        return (self._total + sum(self._block[:self._index])) / n
+
+
+class P2Quantile:
+    """
+    Estimates a quantile of a stream of observations with the P-square algorithm of Jain and Chlamtac. Only five markers
+    are stored, so the memory use does not grow with the number of observations.
+    """
+    def __init__(self, p):
+        self.p = p
+        self.heights = []
+        self.positions = [1, 2, 3, 4, 5]
+        self.desired = [1, 1 + 2 * p, 1 + 4 * p, 3 + 2 * p, 5]
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        q, n = self.heights, self.positions
+        if len(q) < 5:
+            insort(q, x)
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect_right(q, x) - 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+        for i in (1, 2, 3):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * ((n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                                                         (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if len(self.heights) < 5:
+            if not self.heights:
+                return np.nan
+            return self.heights[int(round(self.p * (len(self.heights) - 1)))]
+        return self.heights[2]
+
+
+class Tally:
+    """
+    The tally collects the count, mean, variance, minimum and maximum of a stream of observations in constant memory,
+    using the online algorithm of Welford. Optionally, quantiles are estimated with P-square estimators.
+    """
+    def __init__(self, quantiles=()):
+        self.n = 0
+        self.mean = np.nan
+        self.min = np.inf
+        self.max = -np.inf
+        self._m2 = 0.
+        self.quantiles = {p: P2Quantile(p) for p in quantiles}
+
+    def add(self, x):
+        self.n += 1
+        if self.n == 1:
+            self.mean = x
+        else:
+            delta = x - self.mean
+            self.mean += delta / self.n
+            self._m2 += delta * (x - self.mean)
+        if x < self.min:
+            self.min = x
+        if x > self.max:
+            self.max = x
+        for estimator in self.quantiles.values():
+            estimator.add(x)
+
+    def var(self):
+        if self.n < 2:
+            return np.nan
+        return self._m2 / (self.n - 1)
+
+    def std(self):
+        return np.sqrt(self.var())
+
+    def quantile(self, p):
+        return self.quantiles[p].value()
+
+
+class Histogram:
+    """
+    The histogram counts how often each non-negative integer value occurs, for example the queue length seen by
+    arriving jobs. The counts are kept in a list indexed by value, so the memory use is bounded by the largest value,
+    which for queue lengths is bounded by the buffer size. The summaries are computed on the counts as an array and
+    cached until the next value is added.
+    """
+    def __init__(self):
+        self._counts = []
+        self.n = 0
+        self._cache = {}
+
+    def add(self, value):
+        if value >= len(self._counts):
+            self._counts.extend([0] * (value + 1 - len(self._counts)))
+        self._counts[value] += 1
+        self.n += 1
+        if self._cache:
+            self._cache = {}
+
+    def cached(self, name, f):
+        if name not in self._cache:
+            self._cache[name] = f()
+        return self._cache[name]
+
+    def array(self):
+        return self.cached('array', lambda: np.array(self._counts, dtype=np.int64))
+
+    @property
+    def counts(self):
+        # counts of the values that occurred, as a dict
+        return self.cached('counts', lambda: dict_counts(self.array()))
+
+    def max(self):
+        return len(self._counts) - 1
+
+    def mean(self):
+        counts = self.array()
+        return np.arange(len(counts)) @ counts / self.n
+
+    def distribution(self):
+        return {v: c * 1. / self.n for v, c in self.counts.items()}
+
+
+class TimeAverage:
+    """
+    The time average collects time-weighted statistics of a piecewise constant, non-negative integer value, like the
+    length of a queue or the number of busy units. It is only updated when the value changes, and keeps the area under
+    the curve and the time spent at every value in a list indexed by value, so the memory use is bounded by the largest
+    value. The statistics up to a given time include the time spent at the current value since the last change.
+    """
+    def __init__(self, value=0, start=0.):
+        self.value = value
+        self.start = start
+        self.last = start
+        self.area = 0.
+        self._times = []
+
+    def update(self, time, value):
+        dt = time - self.last
+        if dt:
+            self.area += dt * self.value
+            if self.value >= len(self._times):
+                self._times.extend([0.] * (self.value + 1 - len(self._times)))
+            self._times[self.value] += dt
+        self.value = value
+        self.last = time
+
+    def times(self, time=None):
+        # time spent at every value up to time
+        times = np.zeros(max(len(self._times), self.value + 1))
+        times[:len(self._times)] = self._times
+        if time is not None:
+            times[self.value] += time - self.last
+        return times
+
+    def mean(self, time=None):
+        time = self.last if time is None else time
+        if time <= self.start:
+            return np.nan
+        return (self.area + (time - self.last) * self.value) / (time - self.start)
+
+    def occupancy(self, time=None):
+        # fraction of time spent at every value
+        times = self.times(time)
+        return times / times.sum() if times.sum() else times
+
+
+def dict_counts(counts):
+    # converts an array of counts per value (np.bincount) to a dict of the values that occur
+    values = np.flatnonzero(counts)
+    return dict(zip(values.tolist(), counts[values].tolist()))
+
+
+def sort_by_time(times, values):
+    # sorts times and values on time as numpy arrays; entries with equal times keep the order in which they were logged
+    order = np.argsort(times, kind='stable')
+    return times[order], values[order]
+
+
+def mser(means):
+    """
+    Returns the MSER truncation point of a series of (batch) means: the number d of leading values that minimizes the
+    squared standard error of the mean of the remaining values, sum((y[d:] - mean)^2) / (k - d)^2. Only the first half
+    of the series is searched, as truncation points beyond that are not reliable.
+    """
+    y = np.asarray(means, dtype=float)
+    k = len(y)
+    if k < 2:
+        return 0
+    n = np.arange(k, 0, -1)
+    s1 = np.cumsum(y[::-1])[::-1]
+    s2 = np.cumsum(y[::-1] ** 2)[::-1]
+    stat = (s2 - s1 ** 2 / n) / n ** 2
+    return int(np.argmin(stat[:(k + 1) // 2]))
+
+
+class MSER:
+    """
+    The MSER collector detects the end of the warm-up period of a stream of observations with the MSER-5 rule: the
+    observations are averaged in batches of five and the truncation point is found on the batch means (see mser). The
+    batch means take a fifth of the memory of the observations. When maxBatches batch means are collected, adjacent
+    batch means are merged and the batch size is doubled, so the memory use is bounded.
+    """
+    def __init__(self, batch=5, maxBatches=100000):
+        self.batch = batch
+        self.maxBatches = 2 * (maxBatches // 2)
+        self.means = []
+        self._sum = 0.
+        self._count = 0
+
+    def add(self, x):
+        self._sum += x
+        self._count += 1
+        if self._count == self.batch:
+            self.means.append(self._sum / self.batch)
+            self._sum = 0.
+            self._count = 0
+            if len(self.means) >= self.maxBatches:
+                means = np.asarray(self.means)
+                self.means = list((means[0::2] + means[1::2]) / 2.)
+                self.batch *= 2
+
+    def truncation(self):
+        # number of batch means in the warm-up period
+        return mser(self.means)
+
+    def warmup(self):
+        # number of observations in the warm-up period
+        return self.truncation() * self.batch
+
+    def mean(self):
+        # mean of the observations after the warm-up period
+        d = self.truncation()
+        n = (len(self.means) - d) * self.batch + self._count
+        if n == 0:
+            return np.nan
+        return (sum(self.means[d:]) * self.batch + self._sum) / n
+
+
+class BatchMeans:
+    """
+    The batch means collector estimates the mean of a stream of correlated observations from a single long run. The
+    observations are averaged in non-overlapping batches, and the batch means are treated as independent observations
+    for the Student-t confidence interval. The number of batches is kept between maxBatches / 2 and maxBatches: when
+    maxBatches batches are complete, adjacent batches are merged and the batch size is doubled. The batches therefore
+    grow with the run, which makes the batch means less correlated.
+    """
+    def __init__(self, batch=10, maxBatches=60):
+        self.batch = batch
+        self.maxBatches = 2 * (maxBatches // 2)
+        self.means = []
+        self._sum = 0.
+        self._count = 0
+
+    def add(self, x):
+        # returns True when the observation completes a batch
+        self._sum += x
+        self._count += 1
+        if self._count < self.batch:
+            return False
+        self.means.append(self._sum / self.batch)
+        self._sum = 0.
+        self._count = 0
+        if len(self.means) >= self.maxBatches:
+            means = np.asarray(self.means)
+            self.means = list((means[0::2] + means[1::2]) / 2.)
+            self.batch *= 2
+        return True
+
+    def mean(self):
+        if not self.means:
+            return np.nan
+        return np.mean(self.means)
+
+    def halfwidth(self, confidence=0.95):
+        k = len(self.means)
+        if k < 2:
+            return np.inf
+        return student.ppf(0.5 + confidence / 2., k - 1) * np.std(self.means, ddof=1) / np.sqrt(k)
+
+    def precision(self, confidence=0.95):
+        # relative half width of the confidence interval
+        return self.halfwidth(confidence) / abs(self.mean())
+
+
 class Job:
-    def __init__(self, name=""):
+    def __init__(self, name="", nr=0):
         self.name = name
+        self.nr = nr
         self.arrivalTime = 0
         self.serviceTime = 0
         self.sentTime = 0
@@ -106,6 +593,20 @@ class Job:
         self.serviceTime = time
 
 
+class Batch(Job):
+    """
+    A batch is a group of jobs that is processed by a server under a single service event, and that travels to the next
+    node as a single departure event. Log entries of the batch are written to all jobs in it.
+    """
+    def __init__(self, jobs):
+        super().__init__(name="batch of {}".format(len(jobs)))
+        self.jobs = jobs
+
+    def log(self, *args):
+        for job in self.jobs:
+            job.log(*args)
+
+
 class Sender:
     """
     The sender generates new jobs according to the arrival rate distribution. It uses a self-sustaining event that
@@ -129,7 +630,7 @@ class Sender:
 
     def send(self):
         self.numSentJobs += 1
-        job = Job(name="job: {}".format(self.numSentJobs))
+        job = Job(name="job: {}".format(self.numSentJobs), nr=self.numSentJobs)
         job.sentTime = self.scheduler.now()
         m = Event(self, self.Out, self.scheduler.now(), job, event="arrive")
         self.scheduler.add(m)
@@ -165,161 +666,228 @@ class Observer:
         pass
 
 
-class Queue(SortedSet, Observer):
+class Queue(Observer):
     """
-    The queue is a class that contains all the jobs in queue for its associated server. It behaves like a sortedset
-    implementing a FIFO queueing discipline. Further, the queue implements the observer class: it registers the previous
-    server in line as its observer in order to be able to block processing in this server when the queue becomes full.
+    The queue is a class that contains all the jobs in queue for its associated server. It is backed by a deque
+    implementing a FIFO queueing discipline, so adding and removing jobs takes constant time. Further, the queue
+    implements the observer class: it registers the previous server in line as its observer in order to be able to block
+    processing in this server when the queue becomes full.
+
+    The observers are only notified when the queue crosses a threshold: 'block' when it fills up to maxqueue, and
+    'unblock' once it drops below maxqueue - hysteresis again. With a hysteresis of zero, the upstream server is
+    released as soon as there is room in the queue. The hysteresis has to be below maxqueue, or the upstream server
+    would never be released.
+
+    Once the queue has a scheduler (the Simulator only hands it one with timeStats set), its length is also collected as
+    a time average (see TimeAverage), which gives the exact time-average queue length and the fraction of time spent at
+    every length.
     """
-    def __init__(self, maxqueue):
-        super().__init__(key=lambda job: job.arrivalTime)
-        self.observers = []
+    def __init__(self, maxqueue, hysteresis=0):
+        if not 0 <= hysteresis < maxqueue:
+            raise ValueError('hysteresis {} must be at least 0 and below maxqueue {}'.format(hysteresis, maxqueue))
+        super().__init__()
+        self.jobs = deque()
         self.maxqueue = maxqueue
+        self.release = maxqueue - hysteresis
+        self.full = False
+        self.scheduler = None
+        self.lengthStats = TimeAverage()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __iter__(self):
+        return iter(self.jobs)
 
     def add(self, job):
-        super(Queue, self).add(job)
-        if len(self) >= self.maxqueue:
+        self.put(job)
+        if self.scheduler is not None:
+            self.lengthStats.update(self.scheduler.now(), len(self.jobs))
+        if not self.full and len(self.jobs) >= self.maxqueue:
+            self.full = True
             self.update_observers('block')
 
-    def pop(self, index=-1):
-        value = self._list.pop(index)
-        self._set.remove(value)
-        if len(self) < self.maxqueue:
+    def pop(self):
+        job = self.get()
+        if self.scheduler is not None:
+            self.lengthStats.update(self.scheduler.now(), len(self.jobs))
+        if self.full and len(self.jobs) < self.release:
+            self.full = False
             self.update_observers('unblock')
-        return value
+        return job
+
+    def put(self, job):
+        self.jobs.append(job)
 
+    def get(self):
+        return self.jobs.popleft()
 
-class Server(Machine):
+    def peek(self):
+        return self.jobs[0]
+
+
+class PriorityQueue(Sequenced, Queue):
     """
-    The server is implemented as a state machine. Based on the state of the machine, actions are executed with the
-    server or the jobs in the server. Most actions are executed by using state transitions, but some actions have to be
-    handled by the scheduler (like ending a job at a certain time).
+    The priority queue serves jobs in order of a key, which is the arrival time of the job by default. Jobs with equal
+    keys are served in the order in which they arrived. The jobs are stored in a binary heap.
     """
-    _ids = 0
-    stochastic = None
+    def __init__(self, maxqueue, hysteresis=0, key=arrival_time):
+        super().__init__(maxqueue, hysteresis)
+        self.jobs = []
+        self.key = key
+        self._seq = count()
 
-    def __init__(self, service, maxqueue, mtbf, mttr, mInt, mTime, stoch):
-        super().__init__()
+    def __iter__(self):
+        return (entry[2] for entry in sorted(self.jobs))
 
-        # initialize state machine
-        state = ['Up', 'Failed', 'Maintenance', 'Blocked']
-        Machine.__init__(self, states=state, initial='Up')
-        self.add_transition('start', 'Up', 'Up', after='start_job')
-        self.add_transition('fail', 'Up', 'Failed', after='start_fail')
-        self.add_transition('repair', 'Failed', 'Up', after='rep')
-        self.add_transition('maintain', 'Up', 'Maintenance', after='start_maint')
-        self.add_transition('maintcpl', 'Maintenance', 'Up', after='stop_maint')
-        self.add_transition('interrep', 'Failed', 'Maintenance', after='start_maint')
-        self.add_transition('block', 'Up', 'Blocked')
-        self.add_transition('unblock', 'Blocked', 'Up')
+    def put(self, job):
+        heappush(self.jobs, (self.key(job), next(self._seq), job))
 
-        # initialize all kind of variables
-        self.queue = Queue(maxqueue)
-        self.numServers = 1
-        self.busyServers = 0
-        self.mtbf = mtbf
-        self.mttr = mttr
-        self.maintInt = mInt
-        self.maintTime = mTime
-        self.serviceTimeDistribution = service
-        self.blocked = False
-        Server.stochastic = stoch
+    def get(self):
+        return heappop(self.jobs)[2]
 
-        Server._ids += 1
-        self.name = 'Server {}'.format(Server._ids)
-        self.In, self.Out, self.scheduler, self.activejob, self.interuptjob = None, None, None, None, None
-        self.blocked = False
+    def peek(self):
+        return self.jobs[0][2]
 
-        # logging variables
-        self.jobsarrived = 0
-        self.jobsprocessed = 0
-        self.jobsprocessed = 0
-        self.numfailures = 0
-        self.numMaint = 0
-        self.ctime = []
-        self.logging = []
-        self.idletime = 0
-        self.previdle = 0
+
+queues = {'fifo': Queue, 'priority': PriorityQueue}
+
+
+class MachineError(Exception):
+    pass
+
+
+class StateMachine:
+    """
+    The state machine is a light-weight, table driven replacement for transitions.Machine. A subclass lists its states
+    and its transitions as (trigger, source, destination, after) tuples. For every trigger a method is generated that
+    checks the current state, moves to the destination state and directly calls the after method with the arguments of
+    the trigger. With validate set to True, every transition is also replayed on a transitions.Machine, which raises an
+    error when the table and the library disagree. This is meant for debugging runs only. Every change of state is
+    reported to changed, before the after method is called.
+    """
+    states = []
+    transitions = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        table = defaultdict(dict)
+        for trigger, source, dest, after in cls.transitions:
+            table[trigger][source] = (dest, getattr(cls, after) if after else None)
+        for trigger, moves in table.items():
+            setattr(cls, trigger, StateMachine.make_trigger(trigger, moves))
+
+    def __init__(self, initial, validate=False):
+        self.state = initial
+        self.validator = None
+        if validate:
+            if Machine is None:
+                raise ImportError('Validating the state machine requires the transitions package')
+            self.validator = Machine(states=self.states, initial=initial, auto_transitions=False,
+                                     transitions=[dict(trigger=t, source=s, dest=d) for t, s, d, a in self.transitions])
+
+    @staticmethod
+    def make_trigger(name, moves):
+        def trigger(self, *args, **kwargs):
+            try:
+                dest, after = moves[self.state]
+            except KeyError:
+                raise MachineError("Can't trigger event {} from state {}!".format(name, self.state))
+            if self.validator is not None:
+                getattr(self.validator, name)()
+                if self.validator.state != dest:
+                    raise MachineError('State machine disagrees with transitions on event {}'.format(name))
+            if dest != self.state:
+                self.changed(dest)
+            self.state = dest
+            if after is not None:
+                after(self, *args, **kwargs)
+            return True
+        trigger.__name__ = name
+        return trigger
+
+    def changed(self, dest):
+        pass
+
+
+class Unit(StateMachine):
+    """
+    The unit is one of the identical machines of a server. Every unit is implemented as a state machine with its own
+    failures and maintenance, so a failure only takes down the unit itself while the other units of the server keep
+    processing jobs. The queue, the blocking and the statistics are shared by all units and kept by the server. The
+    time spent in every state is collected as a time average of the index of the state.
+    """
+    states = ['Up', 'Failed', 'Maintenance', 'Blocked']
+    transitions = [('start', 'Up', 'Up', 'start_job'),
+                   ('fail', 'Up', 'Failed', 'start_fail'),
+                   ('repair', 'Failed', 'Up', 'rep'),
+                   ('maintain', 'Up', 'Maintenance', 'start_maint'),
+                   ('maintcpl', 'Maintenance', 'Up', 'stop_maint'),
+                   ('interrep', 'Failed', 'Maintenance', 'start_maint'),
+                   ('block', 'Up', 'Blocked', None),
+                   ('unblock', 'Blocked', 'Up', None)]
+
+    def __init__(self, server, nr, validate=False):
+        super().__init__(initial='Up', validate=validate)
+        self.server = server
+        self.name = '{}.{}'.format(server.name, nr)
+        self.activejob, self.interuptjob = None, None
+        self.endEvent, self.failEvent, self.repairEvent = None, None, None  # handles of pending events
         self.startidle = 0
+        self.stateStats = TimeAverage(value=self.states.index(self.state))
 
-    # Process logic
+    def changed(self, dest):
+        if self.server.timeStats:
+            self.stateStats.update(self.scheduler.now(), self.states.index(dest))
+
+    @property
+    def scheduler(self):
+        return self.server.scheduler
+
+    def idle(self):
+        return self.state == 'Up' and self.activejob is None and self.interuptjob is None
 
     def idle_count(self, var):
         if var == "start":
             self.startidle = self.scheduler.now()
         elif var == "stop":
-            self.idletime += self.scheduler.now() - self.startidle
+            self.server.idletime += self.scheduler.now() - self.startidle
 
     def receive(self, m):
         getattr(self, m.event)(m)
 
-    def send(self, job):  # job departure
-        job.log(self.scheduler.now(), "d", len(self.queue))
-        self.log(self.scheduler.now(), "d", len(self.queue))
-        m = Event(self, self.Out, self.scheduler.now(), job=job, event="arrive")
-        self.scheduler.add(m)
-
-    def arrive(self, m):
-        self.jobsarrived += 1
-        job = m.job
-        job.set_arrival_time(self.scheduler.now())
-        service_time = self.serviceTimeDistribution.rvs()
-        job.set_service_time(service_time)
-        job.log(self.scheduler.now(), "a", self.busyServers + len(self.queue))
-        self.log(self.scheduler.now(), "a", len(self.queue))
-        self.queue.add(m.job)
-        self.trystart()
-
-    def trystart(self):
-        # print(self.name, self.blocked, len(self.queue))
-        if len(self.queue) and self.busyServers < self.numServers and self.state == 'Up' and self.blocked is False:
-            job = self.queue.pop(0)
-            self.busyServers += 1
-            self.start(job)
-            self.idle_count('stop')
-            return True
-        else:
-            return False
-
     # starting and ending jobs #
     def start_job(self, job):
         # logging
-        job.log(self.scheduler.now(), 's', len(self.queue))
+        if self.server.trace:
+            job.log(self.scheduler.now(), 's', len(self.server.queue))
+        if self.server.recorder is not None:
+            self.server.record(job, 's')
         self.activejob = job
         # schedule job end
         t = self.scheduler.now() + job.serviceTime
         m = Event(self, self, t, job=job, event='end')
-        self.scheduler.add(m)
+        self.endEvent = self.scheduler.add(m)
 
     def end(self, m):
-        self.send(m.job)
-        self.jobsprocessed += 1
-        self.busyServers -= 1
+        server = self.server
+        server.send(m.job)
+        server.jobsprocessed += len(m.job.jobs) if isinstance(m.job, Batch) else 1
+        server.busyServers -= 1
+        if server.timeStats:
+            server.busyStats.update(self.scheduler.now(), server.busyServers)
+            server.wipStats.update(self.scheduler.now(), server.jobsarrived - server.jobsprocessed)
         self.idle_count('start')
         self.activejob = None
-        self.departure_stats(m)
-        self.trystart()
-
-    def departure_stats(self, m):
-        ctime = self.scheduler.now() - m.job.arrivalTime
-        self.ctime.append(ctime)
-
-    # Blocking
-    def update(self, arg):
-        # print(self.name, len(self.queue), self.blocked)
-        if arg == 'block':
-            self.blocked = True
-        elif arg == 'unblock':
-            self.blocked = False
-            if self.busyServers == 0:
-                self.trystart()
+        server.departure_stats(m)
+        server.trystart()
 
     # Failures
     def rep(self, *args):
         if self.interuptjob:
             self.resumejob()
         else:
-            self.trystart()
+            self.server.trystart()
             self.idle_count('start')
         if not self.scheduler.completed:
             self.generate_failure()
@@ -329,29 +897,28 @@ class Server(Machine):
             self.interupt_job()
         else:
             self.idle_count('stop')
-        self.numfailures += 1
-        # self.scheduler.print_Self()
+        self.server.numfailures += 1
         if Server.stochastic:
-            t = self.scheduler.now() + self.mttr.rvs()
+            t = self.scheduler.now() + self.server.mttr.rvs()
         else:
-            t = self.scheduler.now() + self.mttr
+            t = self.scheduler.now() + self.server.mttr
         m = Event(self, self, t, job=None, event="repair")
-        self.scheduler.add(m)
+        self.repairEvent = self.scheduler.add(m)
 
     def generate_failure(self):
         if Server.stochastic:
-            t = self.scheduler.now() + self.mtbf.rvs()
+            t = self.scheduler.now() + self.server.mtbf.rvs()
         else:
-            t = self.scheduler.now() + self.mtbf
+            t = self.scheduler.now() + self.server.mtbf
         m = Event(self, self, t, job=None, event="fail")
-        self.scheduler.add(m)
+        self.failEvent = self.scheduler.add(m)
 
     # Maintenance
     def stop_maint(self, *args):
         if self.interuptjob:
             self.resumejob()
         else:
-            self.trystart()
+            self.server.trystart()
             self.idle_count('start')
         if not self.scheduler.completed:
             self.generate_failure()
@@ -362,20 +929,20 @@ class Server(Machine):
             self.interupt_job()
         else:
             self.idle_count('stop')
-        self.scheduler.delete_event(self, 'fail')
-        self.numMaint += 1
+        self.scheduler.cancel(self.failEvent)
+        self.server.numMaint += 1
         if Server.stochastic:
-            t = self.scheduler.now() + self.maintTime.rvs()
+            t = self.scheduler.now() + self.server.maintTime.rvs()
         else:
-            t = self.scheduler.now() + self.maintTime
+            t = self.scheduler.now() + self.server.maintTime
         m = Event(self, self, t, job=None, event="maintcpl")
         self.scheduler.add(m)
 
     def generate_maintenance(self):
         if Server.stochastic:
-            t = self.scheduler.now() + self.maintInt.rvs()
+            t = self.scheduler.now() + self.server.maintInt.rvs()
         else:
-            t = self.scheduler.now() + self.maintInt
+            t = self.scheduler.now() + self.server.maintInt
         m = Event(self, self, t, job=None, event="trigger_maintenance")
         self.scheduler.add(m)
 
@@ -383,7 +950,7 @@ class Server(Machine):
         if self.state == "Up":
             self.maintain()
         elif self.state == "Failed":
-            self.scheduler.delete_event(self, 'repair')
+            self.scheduler.cancel(self.repairEvent)
             self.interrep()
         elif self.state == "Blocked":
             pass
@@ -395,97 +962,409 @@ class Server(Machine):
     def interupt_job(self):
         self.interuptjob = self.activejob
         self.interuptjob.interupted = True
+        if isinstance(self.interuptjob, Batch):
+            for job in self.interuptjob.jobs:
+                job.interupted = True
         self.activejob = None
-        self.scheduler.delete_job(self, self.interuptjob)
+        self.scheduler.cancel(self.endEvent)
 
     def resumejob(self):
         self.activejob = self.interuptjob
         self.interuptjob = None
         t = self.scheduler.now() + self.activejob.serviceTime
         m = Event(self, self, t, job=self.activejob, event="end")
+        self.endEvent = self.scheduler.add(m)
+
+
+class Server:
+    """
+    The server is a station with one or more identical units (machines) that share a single queue. Every unit is
+    implemented as a state machine (see Unit). Based on the state of the units, actions are executed with the server or
+    the jobs in the server. Most actions are executed by using state transitions, but some actions have to be handled
+    by the scheduler (like ending a job at a certain time).
+
+    With a batchSize larger than one, the units process batches of jobs: a unit starts when batchSize jobs are waiting,
+    or when the oldest waiting job has waited batchTimeout seconds, and then takes (at most) batchSize jobs from the
+    queue. Once all jobs have been sent and have arrived at the server, the last partial batch starts without waiting
+    for the timeout. A partial batch also starts when the queue is full and blocks the upstream server, as a batchSize
+    above maxqueue could otherwise never fill up. The service time is drawn once per batch, and the whole batch leaves
+    the server as one departure event.
+    """
+    _ids = 0
+    stochastic = None
+
+    def __init__(self, service, maxqueue, mtbf, mttr, mInt, mTime, stoch, trace=False, validate=False,
+                 discipline='fifo', hysteresis=0, numServers=1, batchSize=1, batchTimeout=None, station=None,
+                 recorder=None, timeStats=False):
+        # initialize all kind of variables
+        self.queue = queues[discipline](maxqueue, hysteresis)
+        self.numServers = numServers
+        self.busyServers = 0
+        self.mtbf = mtbf
+        self.mttr = mttr
+        self.maintInt = mInt
+        self.maintTime = mTime
+        self.serviceTimeDistribution = service
+        self.blocked = False
+        self.batchSize = batchSize
+        self.batchTimeout = batchTimeout
+        self.timeoutEvent = None
+        self.timedout = False
+        Server.stochastic = stoch
+
+        Server._ids += 1
+        self.name = 'Server {}'.format(Server._ids)
+        self.In, self.Out, self.scheduler = None, None, None
+        self.units = [Unit(self, nr, validate=validate) for nr in range(numServers)]
+
+        # logging variables
+        self.jobsarrived = 0
+        self.jobsprocessed = 0
+        self.numfailures = 0
+        self.numMaint = 0
+        self.trace = trace  # keep the full log of arrivals and departures
+        self.station = station  # index of the server in the line
+        self.recorder = recorder  # columnar trace, see eventtrace
+        self.ctStats = Tally()
+        self.queueStats = Histogram()
+        self.timeStats = timeStats
+        self.busyStats = TimeAverage()  # time averages of the busy units, the jobs at the server and the blocking
+        self.wipStats = TimeAverage()
+        self.blockedStats = TimeAverage()
+        self.ctime = []
+        self.arrivalTimes, self.arrivalQueue, self.arrivalInSystem = array('d'), array('l'), array('l')
+        self.departureTimes, self.departureQueue = array('d'), array('l')
+        self._cache = {}
+        self.idletime = 0  # summed over all units
+
+    # Process logic
+
+    def receive(self, m):
+        getattr(self, m.event)(m)
+
+    def send(self, job):  # job departure
+        if self.trace:
+            job.log(self.scheduler.now(), "d", len(self.queue))
+            n = len(job.jobs) if isinstance(job, Batch) else 1
+            self.departureTimes.extend([self.scheduler.now()] * n)
+            self.departureQueue.extend([len(self.queue)] * n)
+        if self.recorder is not None:
+            self.record(job, 'd')
+        m = Event(self, self.Out, self.scheduler.now(), job=job, event="arrive")
         self.scheduler.add(m)
 
-    # Logging and statistics gathering
-    def log(self, *args):
-        self.logging.append(args)
+    def arrive(self, m):
+        for job in (m.job.jobs if isinstance(m.job, Batch) else [m.job]):
+            self.jobsarrived += 1
+            job.set_arrival_time(self.scheduler.now())
+            if self.batchSize == 1:
+                service_time = self.serviceTimeDistribution.rvs()
+                job.set_service_time(service_time)
+            self.queueStats.add(len(self.queue))
+            if self.trace:
+                job.log(self.scheduler.now(), "a", self.busyServers + len(self.queue))
+                self.arrivalTimes.append(self.scheduler.now())
+                self.arrivalQueue.append(len(self.queue))
+                self.arrivalInSystem.append(self.busyServers + len(self.queue))
+            if self.recorder is not None:
+                self.record(job, 'a')
+            self.queue.add(job)
+        if self.timeStats:
+            self.wipStats.update(self.scheduler.now(), self.jobsarrived - self.jobsprocessed)
+        if self.batchSize > 1:
+            self.schedule_timeout()
+        self.trystart()
 
-    def stats(self, t):
-        for l in self.logging:
-            time, action, queue = l[:]
-            if action == t:
-                yield (time, queue)
+    def trystart(self):
+        started = False
+        while self.ready() and self.busyServers < self.numServers and self.blocked is False:
+            unit = self.idle_unit()
+            if unit is None:
+                break
+            job = self.next_job()
+            self.busyServers += 1
+            if self.timeStats:
+                self.busyStats.update(self.scheduler.now(), self.busyServers)
+            unit.start(job)
+            unit.idle_count('stop')
+            started = True
+        return started
+
+    def ready(self):
+        if len(self.queue) >= self.batchSize:
+            return True
+        return len(self.queue) > 0 and (self.timedout or self.queue.full or self.drained())
+
+    def drained(self):
+        # True when the sender has sent all jobs and all of them have arrived here, so no batch can fill up any more
+        sender = self.In
+        while isinstance(sender, Server):
+            sender = sender.In
+        return sender.numSentJobs >= sender.totalJobs and self.jobsarrived >= sender.numSentJobs
+
+    def next_job(self):
+        if self.batchSize == 1:
+            return self.queue.pop()
+        batch = Batch([self.queue.pop() for _ in range(min(self.batchSize, len(self.queue)))])
+        batch.set_service_time(self.serviceTimeDistribution.rvs())
+        self.timedout = False
+        self.scheduler.cancel(self.timeoutEvent)
+        self.timeoutEvent = None
+        self.schedule_timeout()
+        return batch
+
+    # Batch timeouts
+    def schedule_timeout(self):
+        if self.batchTimeout is not None and self.timeoutEvent is None and len(self.queue):
+            t = max(self.scheduler.now(), self.queue.peek().arrivalTime + self.batchTimeout)
+            m = Event(self, self, t, job=None, event="batch_timeout")
+            self.timeoutEvent = self.scheduler.add(m)
+
+    def batch_timeout(self, m):
+        self.timeoutEvent = None
+        self.timedout = True
+        self.trystart()
+
+    def idle_unit(self):
+        for unit in self.units:
+            if unit.idle():
+                return unit
+        return None
+
+    def generate_failure(self):
+        for unit in self.units:
+            unit.generate_failure()
+
+    def generate_maintenance(self):
+        for unit in self.units:
+            unit.generate_maintenance()
+
+    def departure_stats(self, m):
+        for job in (m.job.jobs if isinstance(m.job, Batch) else [m.job]):
+            ctime = self.scheduler.now() - job.arrivalTime
+            self.ctStats.add(ctime)
+            if self.trace:
+                self.ctime.append(ctime)
+
+    # Blocking
+    def update(self, arg):
+        if arg == 'block':
+            self.blocked = True
+            if self.timeStats:
+                self.blockedStats.update(self.scheduler.now(), 1)
+        elif arg == 'unblock':
+            self.blocked = False
+            if self.timeStats:
+                self.blockedStats.update(self.scheduler.now(), 0)
+            if self.busyServers < self.numServers:
+                self.trystart()
+
+    # Logging and statistics gathering
+    def record(self, job, event):
+        for j in (job.jobs if isinstance(job, Batch) else [job]):
+            self.recorder.record(self.scheduler.now(), j.nr, self.station, event, len(self.queue), self.busyServers)
+
+    def idle_percentage(self, total):
+        return self.idletime / (total * self.numServers) * 100
+
+    def time_stats(self, time=None):
+        """
+        Returns the time-weighted statistics of the server up to time (by default the current time): the average queue
+        length, the average work in process (the jobs in the queue and in the units), the utilization (the fraction of
+        unit time spent on a job, including interrupted jobs) and the fraction of unit time spent in every state of the
+        units. Blocked is the fraction of time that the server is blocked by a full downstream queue; the units stay Up
+        while the server is blocked, so Up includes that time. The statistics are only collected with timeStats set.
+        """
+        if not self.timeStats:
+            raise ValueError('time-weighted statistics are only collected with timeStats=True')
+        time = self.scheduler.now() if time is None else time
+        stats = {'queue': self.queue.lengthStats.mean(time), 'wip': self.wipStats.mean(time),
+                 'utilization': self.busyStats.mean(time) / self.numServers}
+        times = np.zeros(len(Unit.states))
+        for unit in self.units:
+            unitTimes = unit.stateStats.times(time)
+            times[:len(unitTimes)] += unitTimes
+        for state, t in zip(Unit.states, times):
+            stats[state] = float(t / times.sum()) if times.sum() else np.nan
+        stats['Blocked'] = self.blockedStats.mean(time)
+        return stats
+
+    def columns(self, name):
+        # log column as a numpy array
+        return np.array(getattr(self, name))
+
+    def cached(self, name, f):
+        # caches the result of f until the next arrival or departure
+        state = (len(self.arrivalTimes), len(self.departureTimes))
+        if self._cache.get('state') != state:
+            self._cache = {'state': state}
+        if name not in self._cache:
+            self._cache[name] = f()
+        return self._cache[name]
 
     def queue_at_arrival_times(self):
-        T, Q = list(), list()
-        for t, q in sorted(self.stats("a")):
-            T.append(t)
-            Q.append(q)
-        return T, Q
+        if self.recorder is not None:
+            records = self.recorder.select('a', self.station)
+            return sort_by_time(records['time'], records['queue'])
+        return self.cached('queue_at_arrival_times', lambda: sort_by_time(self.columns('arrivalTimes'),
+                                                                          self.columns('arrivalQueue')))
 
     def arrival_stats(self):
-        count = defaultdict(int)
-        for t, q, in self.stats("a"):
-            count[q] += 1
-        return count
+        return self.queueStats.counts
 
 
 class Sink:
     """
     The sink is the last node in the simulator. All jobs eventually accumulate in the sink, and are processed here for
-    statistics gathering.
+    statistics gathering. The time in system of the jobs is collected in a tally, with P-square estimates of the given
+    quantiles. Only when tracing is switched on, the finished jobs and their logs are kept, which is needed for the log
+    based statistics below.
+
+    The warmup discards the start-up transient of the empty line from the cycle time. With a number, the first warmup
+    jobs are left out of the tally. With 'mser', the warm-up period is detected with MSER-5 (see MSER), and throughput
+    returns the mean over the jobs after the detected warm-up period.
+
+    The log based statistics are vectorized queries on the log columns that the servers keep when tracing is switched
+    on, or on the recorded trace with a trace recorder (see eventtrace). Both cover all jobs that arrived at a server,
+    also the ones that have not finished yet.
+
+    After set_precision, the cycle times and the times between departures are also collected in batch means (see
+    BatchMeans), and the run stops as soon as the confidence intervals of both have reached the relative precision. The
+    batches start after a fixed warmup; with 'mser' they start at the first job, as the warm-up is only known
+    afterwards.
     """
-    def __init__(self):
+    def __init__(self, trace=False, warmup=None, recorder=None, quantiles=()):
         self.jobs = []
         self.name = "Sink"
         self.In = None
         self.Out = None
         self.scheduler = None
         self.sender = None
+        self.trace = trace
+        self.recorder = recorder
+        self._cache = {}
+        self.numJobs = 0
+        self.finishTime = 0
+        self.tpStats = Tally(quantiles=quantiles)
         self.tpTimes = []
+        self.mser = MSER() if warmup == 'mser' else None
+        self.warmup = 0 if warmup is None or warmup == 'mser' else warmup
+        self.ctBatches = None
+        self.idBatches = None
+        self.precision = None
+        self.confidence = 0.95
+        self.minBatches = 20
+        self.lastFinish = None
+
+    def set_precision(self, precision, confidence=0.95, minBatches=20):
+        self.precision = precision
+        self.confidence = confidence
+        self.minBatches = minBatches
+        if self.ctBatches is None:
+            self.ctBatches = BatchMeans()
+            self.idBatches = BatchMeans()
 
     def receive(self, m):
-        self.jobs.append(m.job)
-        m.job.finishTime = self.scheduler.now()
-        self.tpTimes.append(m.job.finishTime - m.job.sentTime)
-        if len(self.jobs) == self.sender.totalJobs:
+        for job in (m.job.jobs if isinstance(m.job, Batch) else [m.job]):
+            self.numJobs += 1
+            job.finishTime = self.finishTime = self.scheduler.now()
+            ctime = job.finishTime - job.sentTime
+            if self.mser is not None:
+                self.mser.add(ctime)
+            if self.numJobs > self.warmup:
+                self.tpStats.add(ctime)
+                if self.ctBatches is not None:
+                    self.batch_stats(ctime)
+            if self.trace:
+                self.jobs.append(job)
+                self.tpTimes.append(ctime)
+        if self.numJobs >= self.sender.totalJobs:
             self.scheduler.completed = True
             self.scheduler.clear()
 
+    def batch_stats(self, ctime):
+        if self.lastFinish is not None:
+            self.idBatches.add(self.finishTime - self.lastFinish)
+        self.lastFinish = self.finishTime
+        if self.ctBatches.add(ctime) and self.precise():
+            self.scheduler.completed = True
+            self.scheduler.clear()
+
+    def precise(self):
+        # True when the batch means of cycle time and throughput have reached the requested precision
+        if len(self.ctBatches.means) < self.minBatches or len(self.idBatches.means) < self.minBatches:
+            return False
+        return max(self.ctBatches.precision(self.confidence),
+                   self.idBatches.precision(self.confidence)) <= self.precision
+
+    def batch_results(self):
+        """
+        Returns the batch means estimates of the cycle time and the throughput (items per second) with the half widths
+        of their confidence intervals. The interval of the throughput is derived from the interval of the mean time
+        between departures.
+        """
+        ct, inter = self.ctBatches, self.idBatches
+        low, high = inter.mean() - inter.halfwidth(self.confidence), inter.mean() + inter.halfwidth(self.confidence)
+        return {'cycletime': ct.mean(), 'cycletimeHalfwidth': ct.halfwidth(self.confidence),
+                'throughput': 1. / inter.mean(), 'throughputLow': 1. / high if high > 0 else 0.,
+                'throughputHigh': 1. / low if low > 0 else np.inf, 'batches': len(ct.means), 'batchSize': ct.batch,
+                'jobs': self.numJobs, 'precise': self.precise()}
+
     def send(self):
         pass
 
     def throughput(self):
-        avg = np.mean(self.tpTimes)
-        return avg
+        if self.mser is not None:
+            return self.mser.mean()
+        return self.tpStats.mean
 
-    def totaltime(self):
-        return self.jobs[-1].finishTime
+    def warmup_jobs(self):
+        # number of jobs discarded as warm-up
+        if self.mser is not None:
+            return self.mser.warmup()
+        return min(self.warmup, self.numJobs)
 
-    def stats(self, t):
-        for j in self.jobs:
-            for l in j.logging:
-                time, action, queue = l[:]
-                if action == t:
-                    yield (time, queue)
+    def totaltime(self):
+        return self.finishTime
+
+    def servers(self):
+        # all servers of the line, following the In relations
+        node, servers = self.In, []
+        while isinstance(node, Server):
+            servers.append(node)
+            node = node.In
+        return servers[::-1]
+
+    def columns(self, name):
+        # log column of all servers, as one numpy array
+        return np.concatenate([server.columns(name) for server in self.servers()])
+
+    def cached(self, name, f):
+        # caches the result of f until the simulation continues
+        state = (self.scheduler.now(), self.numJobs)
+        if self._cache.get('state') != state:
+            self._cache = {'state': state}
+        if name not in self._cache:
+            self._cache[name] = f()
+        return self._cache[name]
 
     def arrival_stats(self):
-        count = defaultdict(int)
-        for t, q, in self.stats("a"):
-            count[q] += 1
-        return count
+        if self.recorder is not None:
+            records = self.recorder.select('a')
+            return dict_counts(np.bincount(records['queue'] + records['busy']))
+        return self.cached('arrival_stats', lambda: dict_counts(np.bincount(self.columns('arrivalInSystem'))))
 
     def departure_stats(self):
-        count = defaultdict(int)
-        for t, q, in self.stats("d"):
-            count[q] += 1
-        return count
+        if self.recorder is not None:
+            return dict_counts(np.bincount(self.recorder.select('d')['queue']))
+        return self.cached('departure_stats', lambda: dict_counts(np.bincount(self.columns('departureQueue'))))
 
     def queue_at_arrival_times(self):
-        T, Q = list(), list()
-        for t, q in sorted(self.stats("a")):
-            T.append(t)
-            Q.append(q)
-        return T, Q
+        if self.recorder is not None:
+            records = self.recorder.select('a')
+            return sort_by_time(records['time'], records['queue'] + records['busy'])
+        return self.cached('queue_at_arrival_times', lambda: sort_by_time(self.columns('arrivalTimes'),
+                                                                          self.columns('arrivalInSystem')))
 
 
 class Simulator:
@@ -493,36 +1372,75 @@ class Simulator:
     This class is used to instantiate all classes and build the actual simulator model. It uses the inputs to determine
     the number of servers needed, the parameters of these servers and the total amount of jobs. Also, relations between
     the nodes are made and the observer pattern is initialized.
+
+    Every random stream gets its own numpy Generator. The seed is spawned into one child for the sender and one child
+    per server, and every server child is spawned again into its service, failure, repair, maintenance interval and
+    maintenance time streams. Adding a server or changing the parameters of one server therefore leaves the random
+    sequences of all other streams unchanged.
+
+    Statistics are collected in constant memory. Set timeStats to True to also collect the time-weighted queue length,
+    work in process, utilization and state occupancy of the servers (see Server.time_stats), and give quantiles (for
+    example (0.5, 0.9, 0.99)) to estimate quantiles of the cycle time. Both cost run time and are off by default. Set
+    trace to True to also keep the full log of every job and server, which is needed for printJobLog and the log based
+    statistics of the sink. Set validate to True to check all state transitions of the servers against the transitions
+    package (slow, for debugging only). The queueing discipline of all servers is selected by name (see queues). The
+    hysteresis (one value, or a list with one value per server) sets how far a full queue has to drain before the
+    upstream server is released. numServers (one value, or a list with one value per server) sets the number of
+    identical units that work in parallel on the queue of each server. batchSize and batchTimeout (again one value or a
+    list) switch servers to batch processing (see Server). antithetic (False or True) draws all variates by inversion of
+    U or 1 - U, see VariateStream. warmup (a number of jobs, or 'mser' for automatic detection) leaves the start-up
+    transient out of the cycle time of the sink.
+
+    A running simulation can be checkpointed with snapshot or save, and continued later from restore or load. The
+    checkpoint holds the complete state: the event calendar, the units and queues of the servers, the jobs in progress,
+    the random generators and all statistics. fork copies a warmed-up simulation, for branching several scenarios from
+    one state. Checkpoints with validate switched on are not supported.
+
+    Set tracefile to a path to record the full per-job trace in columnar form (see eventtrace.TraceRecorder), with
+    bounded memory. The trace is written to tracefile as a .npy file by closeTrace, after the run.
     """
-    def __init__(self, totaljobs, maxqueue, labda, mu, mtbf, mttr,  mInt, mTime, stoch):
-        np.random.seed(1)
+    def __init__(self, totaljobs, maxqueue, labda, mu, mtbf, mttr,  mInt, mTime, stoch, calendar='heap', seed=1,
+                 trace=False, validate=False, discipline='fifo', hysteresis=0, numServers=1, batchSize=1,
+                 batchTimeout=None, warmup=None, antithetic=None, tracefile=None, timeStats=False, quantiles=()):
         self.checkInput([mu, mtbf, mttr, mInt, mTime])
         self.numSrv = len(mu)
+        self.seed = seed
+        self.stoch = stoch
+        hysteresis = self.per_server(hysteresis)
+        numServers = self.per_server(numServers)
+        self.parameters = dict(labda=labda, mu=mu, mtbf=mtbf, mttr=mttr, mInt=mInt, mTime=mTime, maxqueue=maxqueue,
+                               numServers=numServers)
+        batchSize = self.per_server(batchSize)
+        batchTimeout = self.per_server(batchTimeout)
+        seeds = np.random.SeedSequence(seed).spawn(self.numSrv + 1)
+        self.recorder = None if tracefile is None else eventtrace.TraceRecorder(tracefile)
 
         # initialize sender, scheduler and sink
-        self.sender = Sender(totaljobs, expon(scale=1./labda))
-        self.scheduler = Scheduler()
+        self.sender = Sender(totaljobs, VariateStream(expon(scale=1./labda), np.random.default_rng(seeds[0]),
+                                                        antithetic=antithetic))
+        self.scheduler = Scheduler(calendar)
         self.servers = []
         # initialize all servers
-        if stoch is True:
-            for nr in range(self.numSrv):
-                service = expon(scale=1./mu[nr])
-                mtb = expon(scale=mtbf[nr])
-                mtt = expon(scale=mttr[nr])
-                mIn = expon(scale=mInt[nr])
-                mTim = expon(scale=mTime[nr])
-                mq = maxqueue[nr]
-                self.servers.append(Server(service, mq, mtbf=mtb, mttr=mtt, mInt=mIn, mTime=mTim, stoch=stoch))
-        else:
-            for nr in range(self.numSrv):
-                service = expon(scale=1./mu[nr])
+        for nr in range(self.numSrv):
+            rng = [np.random.default_rng(s) for s in seeds[nr + 1].spawn(5)]
+            service = VariateStream(expon(scale=1./mu[nr]), rng[0], antithetic=antithetic)
+            if stoch is True:
+                mtb = VariateStream(expon(scale=mtbf[nr]), rng[1], antithetic=antithetic)
+                mtt = VariateStream(expon(scale=mttr[nr]), rng[2], antithetic=antithetic)
+                mIn = VariateStream(expon(scale=mInt[nr]), rng[3], antithetic=antithetic)
+                mTim = VariateStream(expon(scale=mTime[nr]), rng[4], antithetic=antithetic)
+            else:
                 mtb = mtbf[nr]
                 mtt = mttr[nr]
                 mIn = mInt[nr]
                 mTim = mTime[nr]
-                mq = maxqueue[nr]
-                self.servers.append(Server(service, mq, mtbf=mtb, mttr=mtt, mInt=mIn, mTime=mTim, stoch=stoch))
-        self.sink = Sink()
+            mq = maxqueue[nr]
+            self.servers.append(Server(service, mq, mtbf=mtb, mttr=mtt, mInt=mIn, mTime=mTim, stoch=stoch,
+                                       trace=trace, validate=validate, discipline=discipline,
+                                       hysteresis=hysteresis[nr], numServers=numServers[nr], batchSize=batchSize[nr],
+                                       batchTimeout=batchTimeout[nr], station=nr, recorder=self.recorder,
+                                       timeStats=timeStats))
+        self.sink = Sink(trace, warmup, self.recorder, quantiles)
 
         # establish relations between nodes and scheduler
         self.sender.Out = self.servers[0]
@@ -540,6 +1458,8 @@ class Simulator:
 
         # register server N as observer for server N-1
         for server in self.servers:
+            if timeStats:
+                server.queue.scheduler = self.scheduler
             if isinstance(server.In, Server):
                 server.queue.register(server.In)
                 # print(server.name,'registers',server.In.name, 'as observer')
@@ -551,17 +1471,17 @@ class Simulator:
 
         self.sender.start()
 
-    def runDebug(self):
+    def runDebug(self, precision=None, confidence=0.95):
+        if precision is not None:
+            self.sink.set_precision(precision, confidence)
         self.scheduler.run()
 
         # create output
         print('Queue length distribution:')
         for srv in range(self.numSrv):
             print('Server{}'.format(srv))
-            stats = self.servers[srv].arrival_stats()
-            S = sum(stats.values())
-            for i, v in stats.items():
-                print(i, v*1./S)
+            for i, v in self.servers[srv].queueStats.distribution().items():
+                print(i, v)
 
         for i in range(self.numSrv):
             print('Processed on server{}:'.format(i), self.servers[i].jobsprocessed, 'Arrived:',
@@ -569,28 +1489,44 @@ class Simulator:
                   self.servers[i].numMaint)
 
         print('Cycle time: {:.5} seconds'.format(self.sink.throughput()))
+        if self.sink.warmup_jobs():
+            print('Warm-up: {} jobs discarded'.format(self.sink.warmup_jobs()))
 
         for i in range(self.numSrv):
-            print("Server {} has max queue length: {}".format(i, max(self.servers[i].arrival_stats())))
+            print("Server {} has max queue length: {}".format(i, self.servers[i].queueStats.max()))
 
         for i in range(self.numSrv):
-            print("Server {} has CT: {:.5} seconds".format(i, np.mean(self.servers[i].ctime)))
+            print("Server {} has CT: {:.5} seconds".format(i, self.servers[i].ctStats.mean))
 
         print("Total time taken: {0:.2f} seconds".format(self.sink.totaltime()))
 
-        total = self.sender.totalJobs / self.sink.totaltime()
+        total = self.sink.numJobs / self.sink.totaltime()
         print("Total throughput: {} items per second".format(total))
 
+        if precision is not None:
+            result = self.sink.batch_results()
+            print('Batch means over {jobs} jobs ({batches} batches of {batchSize} jobs):'.format(**result))
+            print('Cycle time: {:.5} +/- {:.5} seconds'.format(result['cycletime'], result['cycletimeHalfwidth']))
+            print('Throughput: {:.5} [{:.5}, {:.5}] items per second'.format(result['throughput'],
+                                                                           result['throughputLow'],
+                                                                           result['throughputHigh']))
+
         print('Idle percentage:')
         for server in self.servers:
-            print('{0}: {1:.2f}'.format(server.name, server.idletime/self.sink.totaltime()*100), '%')
+            print('{0}: {1:.2f}'.format(server.name, server.idle_percentage(self.sink.totaltime())), '%')
+
+        if self.servers[0].timeStats:
+            print('Time averages (queue, WIP, utilization, Up, Failed, Maintenance, Blocked):')
+            for server in self.servers:
+                print('{name}: {queue:.2f} {wip:.2f} {utilization:.2%} {Up:.2%} {Failed:.2%} {Maintenance:.2%} '
+                      '{Blocked:.2%}'.format(name=server.name, **server.time_stats()))
 
         # prints log for last job. Uncomment for use
         # variable = self.sink.jobs[-1].logging
         # for i in range(len(variable)):
         #     print(variable[i])
 
-    # Print job log of job with name
+    # Print job log of job with name (needs trace)
     def printJobLog(self, name):
         for job in self.sink.jobs:
             if job.interupted:
@@ -599,6 +1535,12 @@ class Simulator:
                 for i in range(len(job.logging)):
                     print(job.logging[i])
 
+    # expand a single value to a list with one value per server
+    def per_server(self, value):
+        if value is None or np.isscalar(value):
+            return [value] * self.numSrv
+        return value
+
     # check for input
     def checkInput(self, values):
         n = len(values[0])
@@ -608,6 +1550,71 @@ class Simulator:
             print('Error in input! Check dimensions of input lists')
             exit()
 
-    def run(self):
-        self.scheduler.run()
+    def analytic(self):
+        """
+        Returns the analytic (Jackson network) estimate of the line, see analytic.tandem. If the simulation has already
+        produced jobs, the relative deviation of the simulated cycle time from the estimate is added as 'deviation'.
+        """
+        estimate = analytic.tandem(**self.parameters)
+        if self.sink.numJobs:
+            estimate['deviation'] = analytic.deviation(estimate, self.sink.throughput())
+        return estimate
+
+    def decomposition(self):
+        """
+        Returns the decomposition estimate of the throughput and mean queue lengths of the line with its finite
+        buffers, see decomposition.decompose.
+        """
+        p = self.parameters
+        return decomposition.decompose(p['mu'], p['mtbf'], p['mttr'], p['maxqueue'], labda=p['labda'],
+                                       mInt=p['mInt'], mTime=p['mTime'])
+
+    def closeTrace(self):
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def controls(self):
+        """
+        Returns the control variates of the run: the deviation of the mean drawn interarrival time and of the mean drawn
+        service time of every server from their known means (1/labda and 1/mu). Their expectation is zero.
+        """
+        streams = [self.sender.timeBetweenConsecutiveJobs] + [s.serviceTimeDistribution for s in self.servers]
+        return [stream.drawn_mean() - stream.mean() for stream in streams]
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        Server.stochastic = self.stoch
+
+    def snapshot(self):
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(data):
+        return pickle.loads(data)
+
+    def fork(self):
+        return Simulator.restore(self.snapshot())
+
+    def save(self, path, compresslevel=1):
+        with gzip.open(path, 'wb', compresslevel=compresslevel) as f:
+            f.write(self.snapshot())
+
+    @staticmethod
+    def load(path):
+        with gzip.open(path, 'rb') as f:
+            return Simulator.restore(f.read())
+
+    def run(self, until=None, max_events=None, precision=None, confidence=0.95):
+        """
+        Runs the simulation and returns the cycle time, see Scheduler.run for until and max_events. With precision set,
+        the run switches to batch means and stops as soon as the confidence intervals of the cycle time and throughput
+        have a relative half width of at most precision; totaljobs then only caps the run length (it may be np.inf).
+        The estimates are returned by Sink.batch_results.
+        """
+        if precision is not None:
+            self.sink.set_precision(precision, confidence)
+        self.scheduler.run(until=until, max_events=max_events)
         return self.sink.throughput()
+
+    def step(self):
+        return self.scheduler.step()
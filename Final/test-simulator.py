@@ -31,22 +31,106 @@ nrJobs = 1e4
 stoch = True
 
 ### Use this code for a single debuging run ####
-experiment = sim.Simulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch)
-experiment.runDebug()
+# The examples that run replications in worker processes re-import this script in every worker, so the runs are kept
+# under the main guard.
+if __name__ == '__main__':
+    experiment = sim.Simulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch)
+    experiment.runDebug()
+
+### Use this code for a single long run with precision-driven run length ####
+# Batch means of cycle time and throughput are collected on the fly, and the run stops as soon as both confidence
+# intervals have a relative half width below precision. The number of jobs then only caps the run length (np.inf for
+# no cap).
+# precision = 0.01
+# experiment = sim.Simulator(1e7, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch, warmup=nrJobs)
+# experiment.runDebug(precision=precision)
+
+### Use this code to checkpoint a warmed-up simulation and branch scenarios from it ####
+# The run is stopped at until (well before the last job leaves) and saved. A fork continues with the same random
+# streams, so it only becomes a different scenario once something is changed, here the service time of the fourth
+# server. The saved run continues the base scenario.
+# from scipy.stats import expon
+# import numpy as np
+# experiment = sim.Simulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch)
+# experiment.run(until=500)
+# experiment.save('warm.ckpt')
+# for seed, speedup in enumerate([1.1, 1.2, 1.5]):
+#     branch = experiment.fork()
+#     branch.servers[3].serviceTimeDistribution = sim.VariateStream(expon(scale=1. / (mu[3] * speedup)),
+#                                                                   np.random.default_rng(seed))
+#     print(speedup, branch.run())
+# experiment = sim.Simulator.load('warm.ckpt')
+# experiment.runDebug()
+
+### Use this code to record the full per-job trace for post-mortem analysis ####
+# The records (time, job, station, event, queue, busy) are kept in bounded memory and written to a .npy file.
+# import numpy as np
+# experiment = sim.Simulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch, tracefile='trace.npy')
+# experiment.run()
+# experiment.closeTrace()
+# T, Q = experiment.servers[0].queue_at_arrival_times()
+# records = np.load('trace.npy', mmap_mode='r')
+
+### Use this code to leave the start-up transient out of the cycle time ####
+# With warmup='mser' the warm-up period is detected with MSER-5; a number discards that many jobs instead.
+# experiment = sim.Simulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch, warmup='mser')
+# experiment.runDebug()
+
+### Use this code for a fast fluid approximation of the same line ####
+# import fluid
+# approximation = fluid.FluidSimulator(nrJobs, maxqueue, labda, mu, mtbf, mttr, mInt, mTime, stoch)
+# approximation.runDebug()
 
 
 
 #### Use this code for comparing experimental results ####
-# valuesMTBF = [30, 50, 100, 200, 300, 500]
-# valuesMTTR = [1, 2, 3, 5, 10]
+# Replications and scenarios are run in parallel over all cores. Each row of the table holds the mean, variance and
+# confidence interval of one output metric of one scenario.
+# if __name__ == '__main__':
+#     import replication as rep
+#     base = dict(totaljobs=nrJobs, maxqueue=maxqueue, labda=labda, mu=mu, mtbf=mtbf, mttr=mttr, mInt=mInt,
+#                 mTime=mTime, stoch=stoch)
+#     valuesMTBF = [[30] * 6, [50] * 6, [100] * 6, [200] * 6, [300] * 6, [500] * 6]
+#     valuesMTTR = [[1] * 6, [2] * 6, [3] * 6, [5] * 6, [10] * 6]
+#
+#     runner = rep.ReplicationRunner(replications=10)
+#     results = runner.run(rep.scenario_grid(base, mtbf=valuesMTBF, mttr=valuesMTTR))
+#     runner.print_table(results)
 #
-# results = []
-# temp = []
-# for j in valuesMTBF:
-#     for i in valuesMTTR:
-#         print('run ', i)
-#         experiment = sim.Simulator(1e4, 10, labda, mu, mtbf=j, mttr=i, mInt=100, mTime=2)
-#         temp.append(experiment.run())
-#     results.append(temp)
+#     # With common random numbers, two scenarios are compared on their paired differences. The reduction column
+#     # estimates how many times fewer replications are needed than with independent seeds (paired=False).
+#     comparison = runner.compare(dict(base, mtbf=valuesMTBF[0]), dict(base, mtbf=valuesMTBF[1]))
+#     runner.print_comparison(comparison)
 #
-# print(results)
+#     # Variance reduction: antithetic pairs (U and 1 - U) or control variates on the known mean interarrival and
+#     # service times. The reduction column shows the achieved variance-reduction factor; they pay off when it is above
+#     # one.
+#     runner.print_table(runner.antithetic(base))
+#     runner.print_table(runner.control_variates(base))
+
+
+#### Use this code for finding the best buffer allocation ####
+# Divides a total budget over the queues of the line with simulated annealing. Candidates are compared with common
+# random numbers, and with screenJobs set, clearly worse candidates are rejected after short runs.
+# if __name__ == '__main__':
+#     import optimization as opt
+#     base = dict(totaljobs=nrJobs, maxqueue=maxqueue, labda=labda, mu=mu, mtbf=mtbf, mttr=mttr, mInt=mInt,
+#                 mTime=mTime, stoch=stoch)
+#     optimizer = opt.BufferOptimizer(base, budget=30000, replications=5, screenJobs=nrJobs / 5)
+#     result = optimizer.run(iterations=20)
+#     print('Best allocation:', result['allocation'], 'throughput:', result['throughput'])
+#     optimizer.print_curve(result['curve'])
+
+
+#### Use this code for selecting the best maintenance policy ####
+# Allocates replications adaptively with the sequential procedure of Kim and Nelson: clearly inferior scenarios are
+# eliminated early, and the selection stops once the best scenario is identified within delta at the given confidence.
+# if __name__ == '__main__':
+#     import selection as sel
+#     import replication as rep
+#     base = dict(totaljobs=nrJobs, maxqueue=maxqueue, labda=labda, mu=mu, mtbf=mtbf, mttr=mttr, mInt=mInt,
+#                 mTime=mTime, stoch=stoch)
+#     scenarios = rep.scenario_grid(base, mInt=[[500] * 6, [1000] * 6, [2000] * 6], mTime=[[1] * 6, [5] * 6])
+#     selector = sel.Selection(delta=0.001, confidence=0.95, n0=10, maxReplications=200)
+#     result = selector.run(scenarios)
+#     selector.print_summary(result)